@@ -1,33 +1,54 @@
 import ast
 import asyncio
-import json
 import logging
 from asyncio import gather
 from asyncio import run as asyncio_run
 from io import BytesIO
 import os
 
-from aiohttp import ClientSession
-from g4f import Provider
-from g4f.client import AsyncClient
-from PIL import Image
 from sqlalchemy import func, text
 from sqlalchemy.future import select
 from telebot import types
 from telebot.async_telebot import AsyncTeleBot
 from telebot.types import Message as TelebotMessage
 
+from backlog import catch_up
+from dispatcher import UpdateDispatcher
 from error_handler import ErrorHandler
+from generations import GenerationCancelled, GenerationRegistry
 from gpt_assistant import settings
-from gpt_assistant._defaults import DEFAULT_CONFIG_VALUES
+from gpt_assistant._defaults import (DEFAULT_CONFIG_VALUES,
+                                     DEFAULT_CONTEXT_BUDGET,
+                                     HISTORY_MAX_MESSAGES,
+                                     MODEL_CONTEXT_BUDGETS)
+from gpt_assistant.cache import LRUCache
 from gpt_assistant.checkers import (check_config, check_owner, cooldown,
-                                   register_missings)
-from gpt_assistant.crud.config import get_config, register_config, update_config
-from gpt_assistant.crud.messages import add_message, get_messages
-from gpt_assistant.crud.users import get_user, register_user
+                                   rate_limiters, register_missings,
+                                   warm_membership_cache)
+from gpt_assistant.clients import client_pool
+from gpt_assistant.completions import completion_cache
+from gpt_assistant.crud.chats import known_chats
+from gpt_assistant.crud.config import (config_cache, get_config,
+                                      register_config, update_config)
+from gpt_assistant.crud.images import (add_image_generation,
+                                      find_image_generation, generation_cache)
+from gpt_assistant.crud.messages import get_messages, message_writer, queue_message
+from gpt_assistant.crud.users import get_user, known_users, register_user
 from gpt_assistant.db import *
-from gpt_assistant.db.models import ImageGeneration
-from utils import extract_text, format_messages, generate_config_message, no_need_to_think
+from gpt_assistant.health import provider_health
+from gpt_assistant.metrics import (handlers_in_flight, metrics, stats_collector,
+                                   track_handler)
+from gpt_assistant.metrics import serve as serve_metrics
+from gpt_assistant.offload import loop_monitor, run_cpu
+from gpt_assistant.offload import shutdown as shutdown_offload
+from gpt_assistant.providers import provider_registry
+from gpt_assistant.tracing import tracer
+from media import file_paths, image_cache, prepare_image
+from outbound import OutboundScheduler
+from streaming import StreamingReply
+from utils import (ThinkFilter, extract_text, format_messages,
+                   generate_config_message, no_need_to_think, split_text)
+from webhook import run_webhook
 
 logger = logging.getLogger(__name__)
 
@@ -39,8 +60,55 @@ bot = AsyncTeleBot(
     exception_handler=ErrorHandler,
 )
 
+outbound = OutboundScheduler(
+    bot,
+    rate=settings.OUTBOUND_RATE,
+    chat_rate=settings.OUTBOUND_CHAT_RATE,
+    chat_burst=settings.OUTBOUND_CHAT_BURST,
+)
+
+generations = GenerationRegistry(timeout=settings.GENERATION_TIMEOUT)
+
+
+def command_of(update: types.Update) -> str | None:
+    text = update.message and (update.message.text or update.message.caption)
+    if not text or not text.startswith("/"):
+        return None
+    return text.split(maxsplit=1)[0][1:].split("@")[0].lower()
+
+
+def is_priority(update: types.Update) -> bool:
+    # /cancel must not wait behind the generation it cancels
+    return update.callback_query is not None or command_of(update) == "cancel"
+
+
+dispatcher = UpdateDispatcher(
+    bot.process_new_updates,
+    concurrency=settings.DISPATCH_CONCURRENCY,
+    priority_concurrency=settings.DISPATCH_PRIORITY_CONCURRENCY,
+    priority=is_priority,
+)
+
+
+def preempt_generations(updates: list[types.Update]) -> None:
+    for update in updates:
+        if command_of(update) == "ask":
+            # a new question replaces the one being answered, or still waiting to be
+            message = update.message
+            generations.cancel(message.chat.id, message.from_user.id, kind="ask", before=message.id)
+
+
+async def dispatch_updates(updates: list[types.Update]) -> None:
+    preempt_generations(updates)
+    await dispatcher.dispatch(updates)
+
+
+# polling and the webhook both hand their updates to process_new_updates
+bot.process_new_updates = dispatch_updates
+
 
 @bot.message_handler(commands=["start"])
+@track_handler("start")
 @register_missings()
 @check_config()
 async def start_command(message: TelebotMessage):
@@ -58,32 +126,36 @@ async def start_command(message: TelebotMessage):
                 user_id=message.from_user.id,
                 **DEFAULT_CONFIG_VALUES,
             )
-            await bot.reply_to(message, welcome_msg)
+            await outbound.reply_to(message, welcome_msg)
         else:
             normal_msg = "Welcome back! How can I assist you today?"
-            await bot.reply_to(message, normal_msg)
+            await outbound.reply_to(message, normal_msg)
 
 
 MAX_MESSAGE_LENGTH = 4096  # Telegram's max message length
 
 
 @bot.message_handler(commands=["ask"])
+@track_handler("ask")
 @register_missings()
 @check_config()
-@cooldown(3)
+@cooldown(3, max_wait=3)
 async def ask_command(message: TelebotMessage):
-    await bot.send_chat_action(message.chat.id, "typing")
+    await outbound.send_chat_action(message.chat.id, "typing")
     async with SessionLocal() as session:
         config = await get_config(session, message.chat.id, message.from_user.id)
+        tracer.current().set(provider=config.provider, model=config.language_model)
 
         messages = await get_messages(
             session,
             message.chat.id,
             message.from_user.id,
             config.language_model.lower(),
-            30,
+            HISTORY_MAX_MESSAGES,
+            token_budget=MODEL_CONTEXT_BUDGETS.get(
+                config.language_model.lower(), DEFAULT_CONTEXT_BUDGET
+            ),
         )
-        config = await get_config(session, message.chat.id, message.from_user.id)
 
         dict_message = {
             "role": "user",
@@ -107,104 +179,181 @@ async def ask_command(message: TelebotMessage):
                     Message.chat_id == message.chat.id,
                     Message.author_id == message.from_user.id,
                 )
-                .order_by(Message.created_at.desc())
+                .order_by(Message.created_at.desc(), Message._id.desc())
                 .limit(1)
             )
             file_hash = result.scalar()
             logger.debug("Fetched file hash from database: %s", file_hash)
             fetched = True
 
-        if file_hash:
-            file = await bot.get_file(file_hash)
-            downloaded_file = await bot.download_file(file.file_path)
+    # the session is closed here, so slow providers don't hold on to pool connections
+    if file_hash:
+        image = await prepare_image(bot, file_hash, config.language_model)
+
+    dict_messages = format_messages(messages, instruction=config.instructions) + [
+        dict_message
+    ]
+    # formatted lazily, only when DEBUG is enabled
+    logger.debug(
+        "Generating response in %d, Messages: %s",
+        message.chat.id,
+        dict_messages,
+    )
+    logger.debug("file hash: %s", file_hash)
+
+    response_message = None
+    use_cache = settings.COMPLETION_CACHE and image is None and config.completion_cache is not False
+
+    if use_cache:
+        response_message = completion_cache.get(
+            completion_cache.make_key(dict_messages, config.provider, config.language_model)
+        )
 
-            bytes_io = BytesIO(downloaded_file)
-            image = Image.open(bytes_io)
+    thinks = config.language_model.lower() == "deepseek-r1"
+    reply = None
 
-        provider = getattr(Provider, config.provider)
-        client = AsyncClient(provider)
+    if config.streaming and response_message is None:
+        reply = StreamingReply(
+            outbound,
+            message,
+            max_length=MAX_MESSAGE_LENGTH,
+            edit_interval=settings.STREAM_EDIT_INTERVAL,
+            transform=ThinkFilter() if thinks else None,
+        )
 
-        dict_messages = format_messages(messages, instruction=config.instructions) + [
-            dict_message
+    providers = [config.provider]
+    if settings.PROVIDER_FAILOVER:
+        providers += [
+            info.name
+            for info in provider_registry.providers_for_model(config.language_model)
         ]
-        logger.debug(
-            "Generating response in %d, Messages: %s",
-            message.chat.id,
-            str(dict_messages),
+
+    async def complete(provider_name: str) -> str:
+        client = client_pool.g4f(provider_name)
+
+        if reply is not None:
+            try:
+                async for chunk in client.chat.completions.create(
+                    model=config.language_model,
+                    messages=dict_messages,
+                    image=image,
+                    stream=True,
+                ):
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        await reply.feed(chunk.choices[0].delta.content)
+                return await reply.finish()
+            finally:
+                # errors, timeouts and cancellations end the stream too
+                await reply.close()
+
+        response = await client.chat.completions.create(
+            model=config.language_model,
+            messages=dict_messages,
+            image=image,
         )
-        logger.debug("file hash: %s", file_hash)
+        response_message = response.choices[0].message.content
+        if thinks:
+            response_message = await run_cpu(no_need_to_think, response_message)
+        return response_message
 
+    if response_message is None:
+        generation = generations.start(message.chat.id, message.from_user.id, "ask", message.id)
         try:
-            response = await client.chat.completions.create(
-                model=config.language_model,
-                messages=dict_messages,
-                image=image,
+            answered_by, response_message = await generation.run(
+                provider_health.call(
+                    providers,
+                    config.language_model,
+                    complete,
+                    timeout=settings.PROVIDER_TIMEOUT,
+                    # a streamed answer is already on screen, it can't be raced or restarted
+                    hedge=settings.PROVIDER_HEDGING and reply is None,
+                    hedge_min_delay=settings.PROVIDER_HEDGE_MIN_DELAY,
+                    can_retry=lambda: reply is None or not reply.text,
+                )
             )
-            response_message = response.choices[0].message.content
-            if config.language_model.lower() == "deepseek-r1":
-                response_message = no_need_to_think(response_message)
+        except GenerationCancelled:
+            return
+        except asyncio.TimeoutError:
+            await outbound.reply_to(message, "⌛️ The response took too long, please try again.")
+            return
         except Exception as err:
-            await bot.reply_to(message, f"❗️ There was an error: {err}")
+            await outbound.reply_to(message, f"❗️ There was an error: {err}")
             return
+        finally:
+            generations.finish(generation)
+
+        if use_cache and response_message:
+            # filed under the provider that answered, which failover may have changed
+            completion_cache.set(
+                completion_cache.make_key(dict_messages, answered_by, config.language_model),
+                response_message,
+            )
 
-        for chunk in split_text(response_message, MAX_MESSAGE_LENGTH):
-            await bot.reply_to(message, chunk)
+    if not response_message or not response_message.strip():
+        # nothing was shown, so there is nothing to remember either
+        await outbound.reply_to(message, "❗️ The model returned an empty response, please try again.")
+        return
 
-        await add_message(
-            session,
-            content=dict_message.get("content"),
-            message_id=message.id,
-            author_id=message.from_user.id,
-            chat_id=message.chat.id,
-            role="user",
-            file_hash=file_hash if not fetched else None,
-            model=config.language_model.lower(),
-        )
-        await add_message(
-            session,
-            content=response_message,
-            message_id=message.id,
-            author_id=message.from_user.id,
-            chat_id=message.chat.id,
-            role="assistant",
-            file_hash=file_hash if not fetched else None,
-            model=config.language_model.lower(),
-        )
+    if reply is None:
+        for chunk in split_text(response_message, MAX_MESSAGE_LENGTH):
+            await outbound.reply_to(message, chunk)
+
+    await queue_message(
+        content=dict_message.get("content"),
+        message_id=message.id,
+        author_id=message.from_user.id,
+        chat_id=message.chat.id,
+        role="user",
+        file_hash=file_hash if not fetched else None,
+        model=config.language_model.lower(),
+    )
+    await queue_message(
+        content=response_message,
+        message_id=message.id,
+        author_id=message.from_user.id,
+        chat_id=message.chat.id,
+        role="assistant",
+        file_hash=file_hash if not fetched else None,
+        model=config.language_model.lower(),
+    )
 
 
-def split_text(text, max_length):
-    return [text[i : i + max_length] for i in range(0, len(text), max_length)]
+@bot.message_handler(commands=["cancel"])
+@track_handler("cancel")
+async def cancel_command(message: TelebotMessage):
+    if generations.cancel(message.chat.id, message.from_user.id, before=message.id):
+        await outbound.reply_to(message, "🛑 Generation cancelled.")
+    else:
+        await outbound.reply_to(message, "Nothing is running, requests still waiting won't be answered.")
 
 
 @bot.message_handler(commands=["imagine"])
+@track_handler("imagine")
 @register_missings()
 @check_config()
 @cooldown(7)
 async def imagine_command(message: TelebotMessage):
     text = extract_text(message.text)
     if not text:
-        await bot.reply_to(
+        await outbound.reply_to(
             message,
             "🚧 Correct usage:\n  -> /imagine **text**\n\n💡 -> You can reply to an image to use it in image generations",
         )
         return
-    await bot.send_chat_action(message.chat.id, "upload_photo")
+    await outbound.send_chat_action(message.chat.id, "upload_photo")
 
     async with SessionLocal() as session:
         config = await get_config(session, message.chat.id, message.from_user.id)
+        tracer.current().set(provider=config.provider, model=config.image_model)
 
         image_model = config.image_model
 
     if not image_model:
-        await bot.reply_to(
+        await outbound.reply_to(
             message, "❗️ Your current provider does not support image generations!"
         )
         return
 
-    client = AsyncClient(
-        image_provider=getattr(Provider, config.provider),
-    )
-
     file_hash = None
     image = None
 
@@ -213,23 +362,55 @@ async def imagine_command(message: TelebotMessage):
     elif message.reply_to_message and message.reply_to_message.photo:
         file_hash = message.reply_to_message.photo[-1].file_id
 
+    if settings.IMAGE_GENERATION_CACHE:
+        async with SessionLocal() as session:
+            cached_file_ids = await find_image_generation(
+                session, text, image_model, file_hash
+            )
+
+        if cached_file_ids:
+            medias = [
+                types.InputMediaPhoto(media=file_id, caption=f"💡 Prompt: _{text}_")
+                for file_id in cached_file_ids
+            ]
+            await outbound.send_media_group(message.chat.id, media=medias)
+            return
+
     if file_hash:
-        file = await bot.get_file(file_hash)
-        downloaded_file = await bot.download_file(file.file_path)
+        image = await prepare_image(bot, file_hash, image_model)
+
+    providers = [config.provider]
+    if settings.PROVIDER_FAILOVER:
+        providers += [
+            info.name for info in provider_registry.providers_for_image_model(image_model)
+        ]
 
-        bytes_io = BytesIO(downloaded_file)
-        image = Image.open(bytes_io)
+    async def generate(provider_name: str):
+        client = client_pool.g4f(provider_name)
+        return await client.images.generate(
+            prompt=text, model=image_model, image=image, response_format="url"
+        )
 
-    response = await client.images.generate(
-        prompt=text, model=config.image_model, image=image, response_format="url"
-    )
+    generation = generations.start(message.chat.id, message.from_user.id, "imagine", message.id)
+    try:
+        _, response = await generation.run(
+            provider_health.call(
+                providers, image_model, generate, timeout=settings.PROVIDER_TIMEOUT
+            )
+        )
+    except GenerationCancelled:
+        return
+    except asyncio.TimeoutError:
+        await outbound.reply_to(message, "⌛️ The generation took too long, please try again.")
+        return
+    finally:
+        generations.finish(generation)
 
     image_urls = [data.url for data in response.data]
 
     async def fetch_image(url: str):
-        async with ClientSession() as session:
-            async with session.get(url) as resp:
-                return BytesIO(await resp.read())
+        async with client_pool.http.get(url) as resp:
+            return BytesIO(await resp.read())
 
     bytes_io_list = await gather(*(fetch_image(url) for url in image_urls))
 
@@ -238,23 +419,22 @@ async def imagine_command(message: TelebotMessage):
         for bytes_io in bytes_io_list
     ]
 
-    messages = await bot.send_media_group(message.chat.id, media=medias)
+    messages = await outbound.send_media_group(message.chat.id, media=medias)
 
     file_hashes = [msg.photo[-1].file_id for msg in messages if msg.photo]
 
     async with SessionLocal() as session:
-        image_generation = ImageGeneration(
+        await add_image_generation(
+            session,
             prompt=text,
             message_id=message.id,
             author_id=message.from_user.id,
             chat_id=message.chat.id,
             input_file_hash=file_hash,
-            output_file_hashes=json.dumps(file_hashes),
+            image_model=image_model,
+            output_file_hashes=file_hashes,
         )
 
-        session.add(image_generation)
-        await session.commit()
-
 
 def get_config_markup(user_id):
     markup = types.InlineKeyboardMarkup(row_width=2)
@@ -266,21 +446,25 @@ def get_config_markup(user_id):
         btn("🖼️ Image Model", callback_data=f"conf_im:{user_id}"),
         btn("📡 Streaming", callback_data=f"conf_streaming:{user_id}"),
     )
+    if settings.COMPLETION_CACHE:
+        # the toggle does nothing while the cache is disabled
+        markup.add(btn("🗃 Answer Cache", callback_data=f"conf_cache:{user_id}"))
 
     return markup
 
 
 
 @bot.message_handler(commands=["config"])
+@track_handler("config")
 @register_missings()
 @check_config()
 async def config_command(message: TelebotMessage):
-    await bot.send_chat_action(message.chat.id, "typing")
+    await outbound.send_chat_action(message.chat.id, "typing")
     markup = get_config_markup(message.from_user.id)
     async with SessionLocal() as session:
         config = await get_config(session, message.chat.id, message.from_user.id)
 
-    await bot.reply_to(
+    await outbound.reply_to(
         message,
         generate_config_message(config),
         reply_markup=markup,
@@ -288,42 +472,47 @@ async def config_command(message: TelebotMessage):
     )
 
 
-async def show_provider_selector(message: TelebotMessage, user_id: int):
-    markup = types.InlineKeyboardMarkup(row_width=3)
+# Selector keyboards by (registry version, kind, provider, user id)
+keyboard_cache = LRUCache(maxsize=10_000)
 
-    all_providers = [
-        getattr(Provider, p)
-        for p in dir(Provider)
-        if isinstance(getattr(Provider, p), type) and p != "Local"
-    ]
 
-    free_providers = [
-        provider
-        for provider in all_providers
-        if hasattr(provider, "supports_system_message")
-        and hasattr(provider, "supports_message_history")
-        and hasattr(provider, "needs_auth")
-        and hasattr(provider, "default_model")
-        and provider.supports_system_message
-        and provider.supports_message_history
-        and not provider.needs_auth
-        and provider.default_model
-    ]
+def build_selector_markup(kind: str, provider: str | None, user_id) -> types.InlineKeyboardMarkup:
+    key = (provider_registry.version, kind, provider, str(user_id))
+    markup = keyboard_cache.get(key)
+    if markup is not None:
+        return markup
+
+    markup = types.InlineKeyboardMarkup(row_width=3)
+
+    if kind == "provider":
+        buttons = [
+            types.InlineKeyboardButton(
+                info.name,
+                callback_data=f"conf_provider_{info.name}:{user_id}",
+            )
+            for info in provider_registry.providers()
+        ]
+    else:
+        info = provider_registry.get(provider)
+        models = (info.models if kind == "lm" else info.image_models) if info else []
+        buttons = [
+            types.InlineKeyboardButton(model, callback_data=f"conf_lm_{model}:{user_id}")
+            for model in models
+        ]
 
-    buttons = [
-        types.InlineKeyboardButton(
-            provider.__name__,
-            callback_data=f"conf_provider_{provider.__name__}:{user_id}",
-        )
-        for provider in free_providers
-    ]
     buttons.append(
         types.InlineKeyboardButton("↬ Back", callback_data=f"conf_back:{user_id}")
     )
 
     markup.add(*buttons)
+    keyboard_cache.set(key, markup)
+    return markup
 
-    await bot.edit_message_text(
+
+async def show_provider_selector(message: TelebotMessage, user_id: int):
+    markup = build_selector_markup("provider", None, user_id)
+
+    await outbound.edit_message_text(
         "🌐 **Please select a provider:**",
         message.chat.id,
         message.id,
@@ -332,63 +521,37 @@ async def show_provider_selector(message: TelebotMessage, user_id: int):
 
 
 async def show_language_model_selector(message: TelebotMessage, user_id):
-    markup = types.InlineKeyboardMarkup(row_width=3)
     async with SessionLocal() as session:
         config = await get_config(session, message.chat.id, int(user_id))
 
         provider = config.provider
 
-    provider_cls = getattr(Provider, provider)
-
-    language_models = provider_cls.models
-
-    buttons = [
-        types.InlineKeyboardButton(model, callback_data=f"conf_lm_{model}:{user_id}")
-        for model in language_models
-    ]
-
-    buttons.append(
-        types.InlineKeyboardButton("↬ Back", callback_data=f"conf_back:{user_id}")
-    )
-
-    markup.add(*buttons)
+    markup = build_selector_markup("lm", provider, user_id)
 
-    await bot.edit_message_text(
+    await outbound.edit_message_text(
         "💬 Select a language model: ", message.chat.id, message.id, reply_markup=markup
     )
 
 
 async def show_image_model_selector(message: TelebotMessage, user_id):
-    markup = types.InlineKeyboardMarkup(row_width=3)
     async with SessionLocal() as session:
         config = await get_config(session, message.chat.id, int(user_id))
 
         provider = config.provider
 
-    provider_cls = getattr(Provider, provider)
-
-    image_models = provider_cls.image_models
-
-    buttons = [
-        types.InlineKeyboardButton(model, callback_data=f"conf_lm_{model}:{user_id}")
-        for model in image_models
-    ]
-
-    buttons.append(
-        types.InlineKeyboardButton("↬ Back", callback_data=f"conf_back:{user_id}")
-    )
-
-    markup.add(*buttons)
+    markup = build_selector_markup("im", provider, user_id)
 
     text = "🖼️ Select an image model: "
 
-    if len(buttons) == 1:
+    info = provider_registry.get(provider)
+    if not info or not info.image_models:
         text = "❗️ Your current provider has no image models"
 
-    await bot.edit_message_text(text, message.chat.id, message.id, reply_markup=markup)
+    await outbound.edit_message_text(text, message.chat.id, message.id, reply_markup=markup)
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("conf_"))
+@track_handler("config_callback")
 @check_config()
 async def handle_config_callback(call: types.CallbackQuery):
     data, user_id = call.data.split(":")
@@ -398,7 +561,7 @@ async def handle_config_callback(call: types.CallbackQuery):
     data = data[5:]
 
     if call.from_user.id != int(user_id):
-        await bot.answer_callback_query(
+        await outbound.answer_callback_query(
             call.id, "⛔ You are not allowed to use this!", show_alert=True
         )
         return
@@ -422,14 +585,22 @@ async def handle_config_callback(call: types.CallbackQuery):
     if data == "streaming":
         config["streaming"] = not conf.streaming
         state = "Enabled" if config["streaming"] else "Disabled"
-        await bot.answer_callback_query(call.id, f"📡 Streaming is now {state}")
+        await outbound.answer_callback_query(call.id, f"📡 Streaming is now {state}")
+
+    if data == "cache" and settings.COMPLETION_CACHE:
+        config["completion_cache"] = conf.completion_cache is False
+        state = "Enabled" if config["completion_cache"] else "Disabled"
+        await outbound.answer_callback_query(call.id, f"🗃 Answer cache is now {state}")
 
     if data.startswith("provider_"):
         provider_name = data[len("provider_") :]
         config["provider"] = provider_name
-        provider_cls = getattr(Provider, provider_name)
-        config["language_model"] = provider_cls.default_model
-        config["image_model"] = getattr(provider_cls, "default_image_model", None)
+        info = provider_registry.get(provider_name)
+        if info is None:
+            await outbound.answer_callback_query(call.id, "❗️ Unknown provider", show_alert=True)
+            return
+        config["language_model"] = info.default_model
+        config["image_model"] = info.default_image_model
 
     if data.startswith("lm_"):
         lm_name = data[len("lm_") :]
@@ -438,12 +609,13 @@ async def handle_config_callback(call: types.CallbackQuery):
     async with SessionLocal() as session:
         await update_config(session, chat_id, user_id=call.from_user.id, **config)
 
-    await bot.edit_message_text(
+    await outbound.edit_message_text(
         generate_config_message(conf), chat_id, message_id, reply_markup=get_config_markup(user_id)
     )
 
 
 @bot.message_handler(commands=["instruction"])
+@track_handler("instruction")
 @register_missings()
 @check_config()
 @cooldown(3)
@@ -451,7 +623,7 @@ async def set_instructions(message: TelebotMessage):
     text = extract_text(message.text)
 
     if not text:
-        await bot.reply_to(message, "🚧 Correct usage:\n  -> /instruction **text**")
+        await outbound.reply_to(message, "🚧 Correct usage:\n  -> /instruction **text**")
         return
 
     async with SessionLocal() as session:
@@ -459,14 +631,16 @@ async def set_instructions(message: TelebotMessage):
             session, message.chat.id, user_id=message.from_user.id, instruction=text
         )
 
-    await bot.reply_to(message, "✏️ instructions updated successfully!")
+    await outbound.reply_to(message, "✏️ instructions updated successfully!")
 
 
 @bot.message_handler(commands="clear_history")
+@track_handler("clear_history")
 @register_missings()
 @check_config()
 @cooldown(3)
 async def clear_history_command(message: TelebotMessage):
+    await message_writer.flush()
     async with SessionLocal() as session:
         result = await session.execute(
             select(func.count(Message._id)).where(
@@ -477,7 +651,7 @@ async def clear_history_command(message: TelebotMessage):
     message_count = result.scalar()
 
     if message_count == 0:
-        await bot.reply_to(message, "You don't have any messages.")
+        await outbound.reply_to(message, "You don't have any messages.")
         return
 
     markup = types.InlineKeyboardMarkup(row_width=2)
@@ -493,7 +667,7 @@ async def clear_history_command(message: TelebotMessage):
 
     markup.add(*buttons)
     s = "" if message_count == 1 else "s"
-    await bot.reply_to(
+    await outbound.reply_to(
         message,
         f"❓️Are you sure you want to clear {message_count} message{s}?",
         reply_markup=markup,
@@ -501,6 +675,7 @@ async def clear_history_command(message: TelebotMessage):
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("ch_confirm_"))
+@track_handler("clear_history_confirm")
 async def clear_yes_no_handler(call: types.CallbackQuery):
     data, user_id = call.data.split(":")
 
@@ -508,31 +683,32 @@ async def clear_yes_no_handler(call: types.CallbackQuery):
     data = data[len("ch_confirm_") :]
 
     if user_id != call.from_user.id:
-        await bot.answer_callback_query(
+        await outbound.answer_callback_query(
             call.id, "⛔ You are not allowed to use this!", show_alert=True
         )
         return
 
     if data == "yes":
-        await bot.edit_message_text(
+        await outbound.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.id,
             text="⌛️ Started purging your history...",
             reply_markup=None,
         )
+        await message_writer.flush()
         async with SessionLocal() as session:
             await session.execute(
                 text("DELETE FROM messages WHERE author_id = :user_id"),
                 {"user_id": user_id},
             )
             await session.commit()
-        await bot.edit_message_text(
+        await outbound.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.id,
             text="✅ Your history has been cleaned successfully",
         )
     elif data == "no":
-        await bot.edit_message_text(
+        await outbound.edit_message_text(
             "❌ Action canceled. ",
             reply_markup=None,
             chat_id=call.message.chat.id,
@@ -555,7 +731,8 @@ def insert_returns(body):
         insert_returns(body[-1].body)
 
 @bot.message_handler(commands=["e", "exec"])
-@check_owner(bot)
+@track_handler("exec")
+@check_owner(outbound)
 async def exec_command(message: TelebotMessage):
 
     try:
@@ -579,21 +756,135 @@ async def exec_command(message: TelebotMessage):
         exec(compile(parsed, filename="<ast>", mode="exec"), env)
         result = await eval(f"{fn_name}()", env)
     except Exception as err:
-        await bot.reply_to(message, f"Execution failed: {err}")
+        await outbound.reply_to(message, f"Execution failed: {err}")
         return
 
     if result is None:
-        await bot.reply_to(message, "✅ Code executed successfully.")
+        await outbound.reply_to(message, "✅ Code executed successfully.")
     else:
         result_str = str(result)
-        await bot.reply_to(message, result_str[:4096]) 
+        await outbound.reply_to(message, result_str[:4096]) 
+
+
+
+
+@bot.message_handler(commands=["stats"])
+@track_handler("stats")
+@check_owner(outbound)
+async def stats_command(message: TelebotMessage):
+    await outbound.submit(
+        message.chat.id,
+        "send_document",
+        message.chat.id,
+        BytesIO(metrics.render().encode()),
+        reply_to_message_id=message.id,
+        visible_file_name="metrics.txt",
+        caption=(
+            f"Handlers in flight: {handlers_in_flight.total()}\n"
+            f"Updates queued: {dispatcher.stats()['queued']}\n"
+            f"Event loop lag: {loop_monitor.last_lag * 1000:.0f} ms"
+        ),
+        parse_mode="",
+    )
+
+
+metrics.collector(
+    stats_collector(
+        "bot_cache",
+        "cache",
+        {
+            "config": config_cache,
+            "completions": completion_cache,
+            "image_generations": generation_cache,
+            "keyboards": keyboard_cache,
+            "file_paths": file_paths,
+            "images": image_cache,
+            "known_users": known_users,
+            "known_chats": known_chats,
+        },
+    )
+)
+metrics.collector(stats_collector("bot_rate_limit", "handler", rate_limiters))
+metrics.collector(
+    stats_collector(
+        "bot_queue",
+        "queue",
+        {"outbound": outbound, "dispatcher": dispatcher, "message_writer": message_writer},
+    )
+)
 
 
+@metrics.collector
+def collect_runtime():
+    yield "bot_event_loop_lag_seconds", {}, loop_monitor.last_lag
+    yield "bot_event_loop_stalls", {}, loop_monitor.stalls
+    yield "bot_generations_running", {}, len(generations)
+    for (provider, model), stats in provider_health.snapshot().items():
+        labels = {"provider": provider, "model": model}
+        yield "bot_provider_circuit_open", labels, int(stats["state"] != "closed")
+        yield "bot_provider_error_rate", labels, stats["error_rate"]
 
 
 async def main():
-    await init_db()
-    await bot.polling()
+    if settings.BOT_MODE == "webhook" and not settings.WEBHOOK_SECRET:
+        # anyone reaching the port could post updates as an owner and reach /exec
+        raise SystemExit("WEBHOOK_SECRET must be set when BOT_MODE=webhook")
 
+    await init_db()
+    await warm_membership_cache()
+    await provider_registry.refresh()
+    await client_pool.start()
+    refresher = asyncio.create_task(
+        provider_registry.refresh_forever(settings.PROVIDER_REFRESH_INTERVAL)
+    )
+    monitor = asyncio.create_task(loop_monitor.run())
+    metrics_server = None
+    if settings.METRICS_PORT:
+        metrics_server = asyncio.create_task(
+            serve_metrics(metrics, settings.METRICS_HOST, settings.METRICS_PORT)
+        )
+    try:
+        # a webhook registered elsewhere keeps the backlog to itself
+        catching_up = settings.BACKLOG_CATCH_UP and (
+            settings.BOT_MODE == "polling" or bool(settings.WEBHOOK_URL)
+        )
+        if catching_up or settings.BOT_MODE == "polling":
+            # getUpdates is refused while a webhook is registered
+            await bot.delete_webhook()
+
+        if catching_up:
+            await catch_up(
+                bot,
+                dispatcher,
+                max_age=settings.BACKLOG_MAX_AGE,
+                batch_size=settings.BACKLOG_BATCH_SIZE,
+                concurrency=settings.BACKLOG_CONCURRENCY,
+                prepare=preempt_generations,
+            )
 
-asyncio_run(main())
+        if settings.BOT_MODE == "webhook":
+            await run_webhook(
+                bot,
+                settings.WEBHOOK_HOST,
+                settings.WEBHOOK_PORT,
+                settings.WEBHOOK_PATH,
+                url=settings.WEBHOOK_URL,
+                secret=settings.WEBHOOK_SECRET,
+            )
+        else:
+            await bot.polling()
+    finally:
+        refresher.cancel()
+        monitor.cancel()
+        if metrics_server is not None:
+            metrics_server.cancel()
+        await dispatcher.join(timeout=30)
+        await outbound.join(timeout=10)
+        await message_writer.stop()
+        await client_pool.close()
+        shutdown_offload()
+
+
+# importable without starting the bot, e.g. by the benchmarks in tests/
+if __name__ == "__main__":
+    asyncio_run(main())
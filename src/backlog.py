@@ -0,0 +1,105 @@
+import time
+from logging import getLogger
+from typing import Callable, Dict, Hashable, List, Optional
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+
+from dispatcher import UpdateDispatcher
+
+logger = getLogger(__name__)
+
+
+def collapse_key(update: Update) -> Optional[Hashable]:
+    """Updates sharing a key supersede each other; only the newest is kept."""
+    message = update.message or update.edited_message
+    if message is not None:
+        if message.from_user is None:
+            return None
+        text = message.text or message.caption or ""
+        kind = "command" if text.startswith("/") else "message"
+        return (kind, message.chat.id, message.from_user.id)
+
+    if update.callback_query is not None and update.callback_query.message is not None:
+        query = update.callback_query
+        # repeated presses on the same keyboard
+        return ("callback", query.message.chat.id, query.message.message_id, query.from_user.id)
+
+    return None
+
+
+def update_date(update: Update) -> Optional[int]:
+    message = update.message or update.edited_message or update.channel_post
+    if message is not None:
+        return message.edit_date or message.date
+    return None
+
+
+def prune_backlog(updates: List[Update], max_age: Optional[float], now: Optional[float] = None) -> List[Update]:
+    """Drops updates older than ``max_age`` seconds and all but the newest of each
+    :func:`collapse_key`, keeping the original order."""
+    now = time.time() if now is None else now
+
+    latest: Dict[Hashable, int] = {}
+    for update in updates:
+        key = collapse_key(update)
+        if key is not None:
+            latest[key] = update.update_id
+
+    kept = []
+    for update in updates:
+        date = update_date(update)
+        if max_age and date is not None and now - date > max_age:
+            continue
+
+        key = collapse_key(update)
+        if key is not None and latest[key] != update.update_id:
+            continue
+
+        kept.append(update)
+    return kept
+
+
+async def catch_up(
+    bot: AsyncTeleBot,
+    dispatcher: UpdateDispatcher,
+    max_age: Optional[float] = 300.0,
+    batch_size: int = 100,
+    concurrency: int = 256,
+    prepare: Optional[Callable[[List[Update]], None]] = None,
+) -> int:
+    """Drains the updates that piled up while the bot was down.
+
+    The whole backlog is fetched first in batches of ``batch_size``, pruned
+    with :func:`prune_backlog` and handed to ``dispatcher`` with its limit
+    raised to ``concurrency`` until the backlog has been handled. Polling
+    resumes after the drained updates, so it can start right away.
+
+    :param prepare: Called with the kept updates before they are dispatched,
+        like the bot does with live updates (e.g. to cancel superseded work).
+    :return: Number of updates dispatched.
+    """
+    updates: List[Update] = []
+    offset = None
+
+    while True:
+        batch = await bot.get_updates(offset=offset, limit=batch_size, timeout=0)
+        if not batch:
+            break
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+
+    if not updates:
+        return 0
+
+    # the last, empty call already confirmed the drained updates to Telegram
+    bot.offset = offset
+
+    kept = prune_backlog(updates, max_age)
+    logger.info("Catching up on %d of %d pending updates", len(kept), len(updates))
+
+    if kept:
+        if prepare is not None:
+            prepare(kept)
+        await dispatcher.boost(concurrency, kept)
+    return len(kept)
@@ -0,0 +1,144 @@
+import asyncio
+from collections import deque
+from logging import getLogger
+from typing import (Awaitable, Callable, Deque, Dict, Hashable, List, Optional,
+                    Set)
+
+from telebot.types import Update
+
+from gpt_assistant.tracing import tracer
+
+logger = getLogger(__name__)
+
+UpdateHandler = Callable[[List[Update]], Awaitable[None]]
+
+
+def is_callback(update: Update) -> bool:
+    return update.callback_query is not None
+
+
+def chat_of(update: Update) -> Optional[int]:
+    for message in (
+        update.message,
+        update.edited_message,
+        update.channel_post,
+        update.edited_channel_post,
+    ):
+        if message is not None:
+            return message.chat.id
+
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+
+    return None
+
+
+class UpdateDispatcher:
+    """Runs updates in order within a chat and in parallel across chats.
+
+    Every chat has a queue drained by a single worker, so the updates of a
+    chat (and the history they write) are handled one after another, while
+    at most ``concurrency`` chats are handled at a time. Updates matching
+    ``priority`` (by default callback queries) are cheap and go through a
+    separate lane with its own queues and limit, so pressing a button isn't
+    stuck behind a slow completion.
+    """
+
+    def __init__(
+        self,
+        handler: UpdateHandler,
+        concurrency: int = 64,
+        priority_concurrency: int = 32,
+        priority: Callable[[Update], bool] = is_callback,
+    ):
+        """
+        :param handler: Processes a list of updates, usually ``bot.process_new_updates``.
+        :param concurrency: Maximum number of updates handled at once.
+        :param priority_concurrency: Maximum number of priority updates handled at once.
+        :param priority: Selects the updates going through the priority lane.
+        """
+        self.handler = handler
+        self.priority = priority
+        self.concurrency = concurrency
+
+        self.dispatched = 0
+        self.failed = 0
+
+        self._slots = asyncio.Semaphore(concurrency)
+        self._priority_slots = asyncio.Semaphore(priority_concurrency)
+        self._queues: Dict[Hashable, Deque[Update]] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+        self._boosted: Set[int] = set()
+        self._boost_done = asyncio.Event()
+        self._boost_task: Optional[asyncio.Task] = None
+
+    async def dispatch(self, updates: List[Update]) -> None:
+        """Queues ``updates`` and returns without waiting for them to be handled."""
+        for update in updates:
+            priority = self.priority(update)
+            chat_id = chat_of(update)
+            # updates without a chat (inline queries, polls...) don't need ordering
+            key = (priority, chat_id if chat_id is not None else f"update:{update.update_id}")
+
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+            queue.append(update)
+
+            if key not in self._workers:
+                self._workers[key] = asyncio.create_task(self._drain(key, queue, priority))
+
+    async def _drain(self, key: Hashable, queue: Deque[Update], priority: bool) -> None:
+        slots = self._priority_slots if priority else self._slots
+        try:
+            while queue:
+                update = queue.popleft()
+                async with slots:
+                    with tracer.trace("update", update_id=update.update_id, chat_id=chat_of(update)):
+                        try:
+                            await self.handler([update])
+                            self.dispatched += 1
+                        except Exception:
+                            self.failed += 1
+                            logger.exception("Failed to handle update %d", update.update_id)
+
+                if self._boosted:
+                    self._boosted.discard(update.update_id)
+                    if not self._boosted:
+                        self._boost_done.set()
+        finally:
+            del self._queues[key]
+            del self._workers[key]
+
+    async def boost(self, concurrency: int, updates: List[Update]) -> None:
+        """Dispatches ``updates`` with the limit raised to ``concurrency`` until
+        all of them have been handled, e.g. to work through a backlog."""
+        extra = max(0, concurrency - self.concurrency)
+        for _ in range(extra):
+            self._slots.release()
+
+        self._boosted.update(update.update_id for update in updates)
+        self._boost_done.clear()
+        self._boost_task = asyncio.create_task(self._unboost(extra))
+
+        await self.dispatch(updates)
+
+    async def _unboost(self, extra: int) -> None:
+        await self._boost_done.wait()
+        # taking the extra slots back lowers the limit as running updates finish
+        for _ in range(extra):
+            await self._slots.acquire()
+        logger.info("Backlog handled, concurrency back to %d", self.concurrency)
+
+    async def join(self, timeout: Optional[float] = None) -> None:
+        """Waits until every queued update has been handled."""
+        if self._workers:
+            await asyncio.wait(list(self._workers.values()), timeout=timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chats": len(self._workers),
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "dispatched": self.dispatched,
+            "failed": self.failed,
+        }
@@ -0,0 +1,142 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Awaitable, Dict, Optional, Tuple, TypeVar
+
+from gpt_assistant.cache import LRUCache
+
+logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class Generation:
+    """Handle of one in-flight generation, which can be cancelled from another update."""
+
+    def __init__(self, key: Tuple[int, int], kind: str, timeout: Optional[float] = None):
+        self.key = key
+        self.kind = kind
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.cancelled = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """Awaits ``awaitable`` within the generation's deadline.
+
+        :raises GenerationCancelled: When :meth:`cancel` was called meanwhile.
+        :raises asyncio.TimeoutError: When the deadline has passed.
+        """
+        if self.cancelled:
+            if asyncio.iscoroutine(awaitable):
+                # never started, closed so it isn't reported as never awaited
+                awaitable.close()
+            raise GenerationCancelled
+
+        timeout = None
+        if self.timeout is not None:
+            timeout = max(0.0, self.started + self.timeout - time.monotonic())
+
+        # the request is the task, so a cancellation before its first step still
+        # throws into the coroutine, which then counts as awaited
+        self._task = asyncio.ensure_future(awaitable)
+        try:
+            return await asyncio.wait_for(self._task, timeout)
+        except asyncio.CancelledError:
+            if self.cancelled:
+                raise GenerationCancelled from None
+            raise
+        finally:
+            self._task = None
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        if self._task is not None:
+            self._task.cancel()
+
+
+class GenerationRegistry:
+    """The running generation of every (chat, user).
+
+    A cancellation also covers the generations of earlier messages that
+    haven't started yet, e.g. still queued in the dispatcher or the backlog:
+    it is remembered per (chat, user) and those generations start cancelled.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, max_pending: int = 10_000, pending_ttl: float = 3600.0):
+        """
+        :param timeout: Seconds a generation may run.
+        :param max_pending: Maximum number of (chat, user) with a remembered cancellation.
+        :param pending_ttl: Seconds a cancellation is remembered for.
+        """
+        self.timeout = timeout
+        self._generations: Dict[Tuple[int, int], Generation] = {}
+        # (chat, user) -> {kind, or None for any: message id the cancellation was issued at}
+        self._pending = LRUCache(maxsize=max_pending, ttl=pending_ttl)
+
+    def get(self, chat_id: int, user_id: int) -> Optional[Generation]:
+        return self._generations.get((chat_id, user_id))
+
+    def start(self, chat_id: int, user_id: int, kind: str, message_id: Optional[int] = None) -> Generation:
+        """Registers a new generation, cancelling the one it replaces.
+
+        :param message_id: Message the generation answers. If a cancellation
+            was issued after it, the generation starts cancelled.
+        """
+        self.cancel(chat_id, user_id)
+        generation = self._generations[(chat_id, user_id)] = Generation(
+            (chat_id, user_id), kind, self.timeout
+        )
+
+        pending = self._pending.get((chat_id, user_id), count=False)
+        if pending and message_id is not None:
+            if message_id < max(pending.get(None, 0), pending.get(kind, 0)):
+                generation.cancelled = True
+                logger.debug("Started %s generation of %d in %d cancelled", kind, user_id, chat_id)
+
+            # the messages of a chat start in order, so older cancellations are spent
+            pending = {k: before for k, before in pending.items() if before > message_id}
+            if pending:
+                self._pending.set((chat_id, user_id), pending)
+            else:
+                self._pending.pop((chat_id, user_id))
+
+        return generation
+
+    def finish(self, generation: Generation) -> None:
+        if self._generations.get(generation.key) is generation:
+            del self._generations[generation.key]
+
+    def cancel(
+        self,
+        chat_id: int,
+        user_id: int,
+        kind: Optional[str] = None,
+        before: Optional[int] = None,
+    ) -> bool:
+        """Cancels the running generation of ``user_id`` in ``chat_id``, if it is of ``kind``.
+
+        :param before: Also cancel the generations of messages older than this
+            message id that haven't started yet.
+        :return: Whether a running generation was cancelled.
+        """
+        if before is not None:
+            pending = self._pending.get((chat_id, user_id), count=False) or {}
+            pending[kind] = max(pending.get(kind, 0), before)
+            self._pending.set((chat_id, user_id), pending)
+
+        generation = self._generations.get((chat_id, user_id))
+        if generation is None or (kind is not None and generation.kind != kind):
+            return False
+
+        generation.cancel()
+        del self._generations[(chat_id, user_id)]
+        logger.debug("Cancelled %s generation of %d in %d", generation.kind, user_id, chat_id)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._generations)
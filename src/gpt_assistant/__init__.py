@@ -1,4 +1,6 @@
-from . import _logger as _
 from ._settings import Settings
 
 settings = Settings()
+
+# configured from settings, so it can only be installed once they are loaded
+from . import _logger as _
@@ -2,6 +2,7 @@ DEFAULT_PROVIDER = "Blackbox"
 DEFAULT_LANGUAGE_MODEL = "gpt-4o"
 DEFAULT_IMAGE_MODEL = "flux"
 DEFAULT_STREAMING_STATUS = False
+DEFAULT_COMPLETION_CACHE_STATUS = True
 DEFAULT_INSTRUCTIONS = (
     "Hey there, I'm Smart Donkey! I'm here to help you out. "
     "I'm pretty good at understanding things, so don't be shy to ask anything!"
@@ -15,10 +16,34 @@ DEFAULT_SYSTEM_MESSAGE = (
     "M. logique made you, so be as helpful and chill as possible."
 )
 
+# Token budget for the conversation history sent along with each /ask,
+# HISTORY_MAX_MESSAGES caps the rows scanned to fill it
+HISTORY_MAX_MESSAGES = 200
+DEFAULT_CONTEXT_BUDGET = 4000
+MODEL_CONTEXT_BUDGETS = {
+    "gpt-4o": 16000,
+    "gpt-4o-mini": 16000,
+    "claude-3.5-sonnet": 16000,
+    "deepseek-r1": 8000,
+    "deepseek-v3": 8000,
+    "llama-3.3-70b": 8000,
+}
+
+# Longest side, in pixels, of images sent to a model
+DEFAULT_IMAGE_MAX_DIMENSION = 1536
+IMAGE_MAX_DIMENSIONS = {
+    "gpt-4o": 2048,
+    "gpt-4o-mini": 2048,
+    "flux": 1024,
+    "flux-pro": 1024,
+    "sdxl-turbo": 1024,
+}
+
 DEFAULT_CONFIG_VALUES = {
     "language_model": DEFAULT_LANGUAGE_MODEL,
     "provider": DEFAULT_PROVIDER,
     "instructions": DEFAULT_INSTRUCTIONS,
     "streaming": DEFAULT_STREAMING_STATUS,
     "image_model": DEFAULT_IMAGE_MODEL,
+    "completion_cache": DEFAULT_COMPLETION_CACHE_STATUS,
 }
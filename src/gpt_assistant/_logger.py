@@ -1,12 +1,111 @@
+import atexit
+import copy
 import datetime
 import os
-from logging import (DEBUG, INFO, FileHandler, Formatter, Logger,
-                     StreamHandler, setLoggerClass)
-from logging.handlers import RotatingFileHandler
-from typing import Optional
+from logging import (INFO, WARNING, FileHandler, Formatter, Handler, Logger,
+                     LogRecord, StreamHandler, getLevelName, setLoggerClass)
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+from typing import Dict, Optional
 
 import pytz
 
+from gpt_assistant import settings
+
+TIMEZONE = pytz.timezone("Asia/Tehran")
+
+
+class TZFormatter(Formatter):
+    """override logging.Formatter to use an aware datetime object"""
+
+    def converter(self, timestamp):
+        return datetime.datetime.fromtimestamp(timestamp, TIMEZONE)
+
+    def formatTime(self, record, datefmt=None):
+        dt = self.converter(record.created)
+        if datefmt:
+            s = dt.strftime(datefmt)
+        else:
+            try:
+                s = dt.isoformat(timespec="milliseconds")
+            except TypeError:
+                s = dt.isoformat()
+        return s
+
+
+# Formatter for log messages, shared by every handler
+formatter = TZFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+
+class RoutingFileHandler(Handler):
+    """Writes every record to the rotating file of the logger it came from."""
+
+    def __init__(self, directory: str, max_log_size: int, backup_count: int):
+        """
+        :param directory: Directory of the ``<logger name>.log`` files.
+        :param max_log_size: Maximum size of a log file before rotation.
+        :param backup_count: Number of backup log files to keep.
+        """
+        super().__init__()
+        self.directory = directory
+        self.max_log_size = max_log_size
+        self.backup_count = backup_count
+        self._handlers: Dict[str, RotatingFileHandler] = {}
+
+    def emit(self, record: LogRecord) -> None:
+        handler = self._handlers.get(record.name)
+        if handler is None:
+            os.makedirs(self.directory, exist_ok=True)
+            handler = self._handlers[record.name] = RotatingFileHandler(
+                os.path.join(self.directory, f"{record.name}.log"),
+                maxBytes=self.max_log_size,
+                backupCount=self.backup_count,
+            )
+            handler.setFormatter(formatter)
+        handler.handle(record)
+
+    def close(self) -> None:
+        for handler in self._handlers.values():
+            handler.close()
+        super().close()
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queues records unformatted, the listener thread does the formatting.
+
+    ``QueueHandler.prepare`` formats the message (and the traceback) on the
+    calling thread so that the record can be pickled; the queue never leaves
+    the process, so the arguments and ``exc_info`` can travel as they are.
+    """
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        return copy.copy(record)
+
+
+log_queue: SimpleQueue = SimpleQueue()
+_listener: Optional[QueueListener] = None
+
+
+def start_listener(max_log_size: int = 1024 * 1024, backup_count: int = 3) -> QueueListener:
+    """Starts the thread doing the console and file output of queued records, once."""
+    global _listener
+
+    if _listener is None:
+        console_handler = StreamHandler()
+        console_handler.setFormatter(formatter)
+
+        _listener = QueueListener(
+            log_queue,
+            console_handler,
+            RoutingFileHandler(settings.LOG_DIR, max_log_size, backup_count),
+            respect_handler_level=True,
+        )
+        _listener.start()
+        # flushes whatever is still queued on shutdown
+        atexit.register(_listener.stop)
+
+    return _listener
+
 
 class CustomLogger(Logger):
     """Custom logger with console and file output, and formatted messages."""
@@ -32,31 +131,15 @@ class CustomLogger(Logger):
         """
 
         super().__init__(name, level)
-        timezone = pytz.timezone("Asia/Tehran")
 
-        # Custom formatter with timezone conversion
-
-        class TZFormatter(Formatter):
-            """override logging.Formatter to use an aware datetime object"""
-
-            def converter(self, timestamp):
-                dt = datetime.datetime.fromtimestamp(timestamp)
-                tzinfo = pytz.timezone("Asia/Tehran")
-                return tzinfo.localize(dt)
-
-            def formatTime(self, record, datefmt=None):
-                dt = self.converter(record.created)
-                if datefmt:
-                    s = dt.strftime(datefmt)
-                else:
-                    try:
-                        s = dt.isoformat(timespec="milliseconds")
-                    except TypeError:
-                        s = dt.isoformat()
-                return s
-
-        # Formatter for log messages
-        formatter = TZFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        if settings.LOG_QUEUE:
+            # formatting and file I/O happen on the listener thread
+            start_listener(max_log_size, backup_count)
+            self.addHandler(LazyQueueHandler(log_queue))
+            # every logger has its own queue handler, records must not be queued twice
+            self.propagate = False
+            self.setLevel(level)
+            return
 
         # Console handler for standard output
         console_handler = StreamHandler()
@@ -87,19 +170,34 @@ class CustomLogger(Logger):
     def log_to_console(self, level: int = INFO) -> None:
         """Logs a message to the console."""
         self.setLevel(level)
-        for handler in self.handlers:
+        for handler in self._output_handlers():
             if isinstance(handler, StreamHandler):
                 handler.setLevel(level)
 
     def log_to_file(self, level: int = INFO) -> None:
         """Logs a message to the file."""
         self.setLevel(level)
-        for handler in self.handlers:
-            if isinstance(handler, FileHandler) or isinstance(
-                handler, RotatingFileHandler
-            ):
+        for handler in self._output_handlers():
+            if isinstance(handler, (FileHandler, RotatingFileHandler, RoutingFileHandler)):
                 handler.setLevel(level)
 
+    def _output_handlers(self):
+        if settings.LOG_QUEUE:
+            # shared by every logger through the listener
+            return start_listener().handlers
+        return self.handlers
+
+
+# loggers of the database libraries, which log every statement and row at INFO/DEBUG
+SQL_LOGGERS = ("sqlalchemy", "aiosqlite")
+
+
+def level_for(name: str) -> int:
+    """Level of a new logger: ``LOG_LEVEL`` for the bot's own, less for the SQL ones."""
+    if name.split(".", 1)[0] in SQL_LOGGERS:
+        return INFO if settings.SQL_ECHO else WARNING
+    return getLevelName(settings.LOG_LEVEL)
+
 
 setLoggerClass(
     type(
@@ -109,11 +207,11 @@ setLoggerClass(
             "__init__": lambda self, name: CustomLogger.__init__(
                 self,
                 name,
-                level=DEBUG,
+                level=level_for(name),
                 backup_count=3,
                 max_log_size=1024 * 1024,
                 log_to_file=True,
-                log_file_path=f"logs/{name}.log",
+                log_file_path=os.path.join(settings.LOG_DIR, f"{name}.log"),
             )
         },
     )
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List, Literal, Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -12,3 +12,78 @@ class Settings(BaseSettings):
     TOKEN: str
     DATABASE_URL: str
     OWNERS: List[int]
+
+    LOG_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
+    LOG_DIR: str = "logs"
+    LOG_QUEUE: bool = True
+    SQL_ECHO: bool = False
+
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: Optional[int] = None
+
+    TRACE_SAMPLE_RATE: float = 0.0
+    TRACE_SLOW_THRESHOLD: Optional[float] = None
+    TRACE_FILE: str = "logs/traces.jsonl"
+    TRACE_MAX_BYTES: int = 10 * 1024 * 1024
+    TRACE_BACKUP_COUNT: int = 3
+
+    CONFIG_CACHE_SIZE: int = 10_000
+    CONFIG_CACHE_TTL: float = 600.0
+    MEMBERSHIP_CACHE_SIZE: int = 1_000_000
+
+    MESSAGE_WRITE_BATCH_SIZE: int = 200
+    MESSAGE_WRITE_INTERVAL: float = 0.5
+    MESSAGE_WRITE_QUEUE_SIZE: int = 10_000
+
+    STREAM_EDIT_INTERVAL: float = 1.5
+
+    OUTBOUND_RATE: float = 30.0
+    OUTBOUND_CHAT_RATE: float = 1.0
+    OUTBOUND_CHAT_BURST: float = 3.0
+
+    DISPATCH_CONCURRENCY: int = 64
+    DISPATCH_PRIORITY_CONCURRENCY: int = 32
+
+    BACKLOG_CATCH_UP: bool = True
+    BACKLOG_MAX_AGE: Optional[float] = 300.0
+    BACKLOG_BATCH_SIZE: int = 100
+    BACKLOG_CONCURRENCY: int = 256
+
+    RATE_LIMIT_MAX_ENTRIES: int = 100_000
+
+    PROVIDER_REFRESH_INTERVAL: float = 3600.0
+    PROVIDER_TIMEOUT: float = 120.0
+    PROVIDER_TIMEOUTS: Dict[str, float] = {}
+    GENERATION_TIMEOUT: Optional[float] = 300.0
+    PROVIDER_FAILOVER: bool = True
+    PROVIDER_HEDGING: bool = False
+    PROVIDER_HEDGE_MIN_DELAY: float = 2.0
+    PROVIDER_HEDGE_COLD_DELAY: float = 10.0
+    PROVIDER_CIRCUIT_OPEN_SECONDS: float = 60.0
+    PROVIDER_MAX_IN_FLIGHT: Optional[int] = 16
+
+    HTTP_POOL_SIZE: int = 100
+    HTTP_POOL_SIZE_PER_HOST: int = 20
+
+    CPU_EXECUTOR: Literal["thread", "process"] = "thread"
+    CPU_WORKERS: Optional[int] = None
+    LOOP_LAG_INTERVAL: float = 0.5
+    LOOP_LAG_THRESHOLD: float = 0.1
+
+    IMAGE_CACHE_BYTES: int = 64 * 1024 * 1024
+    IMAGE_CACHE_DIR: Optional[str] = "cache/images"
+    IMAGE_CACHE_DISK_BYTES: int = 512 * 1024 * 1024
+    IMAGE_FORMAT: Literal["JPEG", "WEBP"] = "JPEG"
+    IMAGE_QUALITY: int = 85
+    IMAGE_GENERATION_CACHE: bool = False
+
+    COMPLETION_CACHE: bool = False
+    COMPLETION_CACHE_SIZE: int = 5_000
+    COMPLETION_CACHE_TTL: float = 3600.0
+
+    BOT_MODE: Literal["polling", "webhook"] = "polling"
+    WEBHOOK_URL: Optional[str] = None
+    WEBHOOK_SECRET: Optional[str] = None
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_PATH: str = "/webhook"
@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import Any, Dict, Hashable, Optional
+
+logger = getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded in-process cache with LRU eviction and per-entry TTL."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        :param maxsize: Maximum number of entries kept before evicting the least recently used one.
+        :param ttl: Seconds an entry stays valid, ``None`` disables expiry.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None, count: bool = True) -> Any:
+        entry = self._data.get(key)
+
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at and expires_at < time.monotonic():
+                del self._data[key]
+            else:
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+
+        if count:
+            self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else 0.0
+
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class IdSet:
+    """Bounded set of known integer ids.
+
+    Membership is exact: a miss only means the caller has to fall back to an
+    idempotent write, so evicting arbitrary ids once the bound is hit is safe.
+    """
+
+    def __init__(self, maxsize: int = 1_000_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._ids: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item: int) -> bool:
+        if item in self._ids:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, item: int) -> None:
+        if item not in self._ids and len(self._ids) >= self.maxsize:
+            self._ids.pop()
+        self._ids.add(item)
+
+    def update(self, items) -> None:
+        for item in items:
+            self.add(item)
+
+    def discard(self, item: int) -> None:
+        self._ids.discard(item)
+
+    def clear(self) -> None:
+        self._ids.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._ids),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class FileCache:
+    """Two-tier byte cache: an in-memory LRU bounded by total size, spilling to disk.
+
+    Entries evicted from memory are written to ``directory`` (if set), which is
+    itself trimmed to ``max_disk_bytes`` by evicting the least recently used
+    files. Disk I/O runs in a worker thread.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        directory: Optional[str] = None,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+    ):
+        """
+        :param max_bytes: Memory budget for cached payloads.
+        :param directory: Spill directory, ``None`` keeps the cache memory-only.
+        :param max_disk_bytes: Disk budget for the spill directory.
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            entries = sorted(os.scandir(directory), key=lambda e: e.stat().st_mtime)
+            for entry in entries:
+                if entry.is_file():
+                    size = entry.stat().st_size
+                    self._disk[entry.name] = size
+                    self._disk_bytes += size
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    @property
+    def disk_bytes(self) -> int:
+        return self._disk_bytes
+
+    async def get(self, key: str) -> Optional[bytes]:
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return data
+
+        name = self._filename(key)
+        if name in self._disk:
+            try:
+                data = await asyncio.to_thread(self._read, name)
+            except OSError:
+                logger.warning("Dropping unreadable cache file %s", name)
+                self._forget(name)
+            else:
+                self._disk.move_to_end(name)
+                self.disk_hits += 1
+                await self._remember(key, data)
+                return data
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, data: bytes) -> None:
+        await self._remember(key, data)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    async def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            await self._spill(key, data)
+            return
+
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+
+        while self._memory_bytes > self.max_bytes:
+            old_key, old_data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_data)
+            await self._spill(old_key, old_data)
+
+    async def _spill(self, key: str, data: bytes) -> None:
+        if not self.directory or len(data) > self.max_disk_bytes:
+            return
+
+        name = self._filename(key)
+        if name in self._disk:
+            self._disk.move_to_end(name)
+            return
+
+        try:
+            await asyncio.to_thread(self._write, name, data)
+        except OSError:
+            logger.exception("Could not spill %s to disk", key)
+            return
+
+        self._disk[name] = len(data)
+        self._disk_bytes += len(data)
+
+        while self._disk_bytes > self.max_disk_bytes:
+            old_name = next(iter(self._disk))
+            self._forget(old_name)
+            await asyncio.to_thread(self._remove, old_name)
+
+    def _forget(self, name: str) -> None:
+        self._disk_bytes -= self._disk.pop(name, 0)
+
+    @staticmethod
+    def _filename(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _read(self, name: str) -> bytes:
+        with open(os.path.join(self.directory, name), "rb") as file:
+            return file.read()
+
+    def _write(self, name: str, data: bytes) -> None:
+        path = os.path.join(self.directory, name)
+        with open(f"{path}.tmp", "wb") as file:
+            file.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def _remove(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
@@ -1,4 +1,4 @@
-import time
+import asyncio
 from functools import wraps
 from logging import getLogger
 
@@ -7,14 +7,17 @@ from telebot.types import Message as TelebotMessage
 
 from gpt_assistant import settings
 from gpt_assistant._defaults import DEFAULT_CONFIG_VALUES
-from gpt_assistant.crud.chats import get_chat, register_chat
+from gpt_assistant.crud.chats import ensure_chat, known_chats, warm_known_chats
 from gpt_assistant.crud.config import get_config, register_config
-from gpt_assistant.crud.users import get_user, register_user
+from gpt_assistant.crud.users import ensure_user, known_users, warm_known_users
 from gpt_assistant.db import SessionLocal
+from gpt_assistant.ratelimit import RateLimiter
+from gpt_assistant.tracing import tracer
 
 logger = getLogger(__name__)
 
-user_cooldowns = {}
+# RateLimiter of every function decorated with @cooldown, by qualified name
+rate_limiters = {}
 
 
 def check_config():
@@ -24,11 +27,12 @@ def check_config():
             msg = message
             if isinstance(message, CallbackQuery):
                 msg = message.message
-            async with SessionLocal() as session:
-                config = await get_config(session, msg.chat.id, message.from_user.id)
+            with tracer.span("check_config"):
+                async with SessionLocal() as session:
+                    config = await get_config(session, msg.chat.id, message.from_user.id)
 
-                if not config:
-                    await register_config(session, msg.chat.id,user_id=message.from_user.id, **DEFAULT_CONFIG_VALUES)
+                    if not config:
+                        await register_config(session, msg.chat.id,user_id=message.from_user.id, **DEFAULT_CONFIG_VALUES)
 
             return await handler(message, *args, **kwargs)
 
@@ -41,13 +45,25 @@ def register_missings():
     def decorator(handler):
         @wraps(handler)
         async def wrapper(message: TelebotMessage, *args, **kwargs):
-            async with SessionLocal() as session:
-                user = await get_user(session, message.from_user.id)
-                chat = await get_chat(session, message.chat.id)
-                if not user:
-                    await register_user(session, message.from_user.id)
-                if not chat:
-                    await register_chat(session, message.chat.id)
+            user_id = message.from_user.id
+            chat_id = message.chat.id
+
+            with tracer.span("register_missings") as span:
+                missing_user = user_id not in known_users
+                missing_chat = chat_id not in known_chats
+                span.set(missing_user=missing_user, missing_chat=missing_chat)
+
+                if missing_user or missing_chat:
+                    async with SessionLocal() as session:
+                        if missing_user:
+                            await ensure_user(session, user_id)
+                        if missing_chat:
+                            await ensure_chat(session, chat_id)
+                        await session.commit()
+
+                    known_users.add(user_id)
+                    known_chats.add(chat_id)
+
             return await handler(message, *args, **kwargs)
 
         return wrapper
@@ -55,12 +71,22 @@ def register_missings():
     return decorator
 
 
-def check_owner(bot):
+async def warm_membership_cache():
+    async with SessionLocal() as session:
+        users = await warm_known_users(session)
+        chats = await warm_known_chats(session)
+
+    logger.info("Membership cache warmed with %d users and %d chats", users, chats)
+
+
+def check_owner(outbound):
+    """:param outbound: ``OutboundScheduler`` the refusal is sent through."""
+
     def decorator(handler):
         @wraps(handler)
         async def wrapper(message: TelebotMessage, *args, **kwargs):
             if not message.from_user.id in settings.OWNERS:
-                return await bot.reply_to(message, "نه")
+                return await outbound.submit(message.chat.id, "reply_to", message, "نه")
             return await handler(message, *args, **kwargs)
 
         return wrapper
@@ -68,20 +94,37 @@ def check_owner(bot):
     return decorator
 
 
-def cooldown(seconds: int):
+def cooldown(seconds: float, burst: int = 1, max_wait: float = 0.0):
+    """Limits how often each user may call the decorated handler.
+
+    :param seconds: Seconds it takes to earn one more call.
+    :param burst: Calls a user may make back to back.
+    :param max_wait: If set, a call arriving too early waits up to this many
+        seconds for its turn instead of being dropped.
+    """
+
     def decorator(func):
+        limiter = RateLimiter(
+            rate=1 / seconds,
+            burst=burst,
+            max_entries=settings.RATE_LIMIT_MAX_ENTRIES,
+        )
+        rate_limiters[func.__qualname__] = limiter
+
         @wraps(func)
         async def wrapper(message, *args, **kwargs):
-            user_id = message.from_user.id
-            current_time = time.time()
-
-            if user_id in user_cooldowns:
-                last_request_time = user_cooldowns[user_id]
-                if current_time - last_request_time < seconds:
-                    # await message.reply(f"⌛️ Please wait {seconds - (current_time - last_request_time):.1f} seconds before making another request.")
-                    return
+            delay = limiter.acquire(message.from_user.id, max_wait=max_wait)
+
+            if delay is None:
+                logger.debug(
+                    "Dropped %s from %d: rate limited",
+                    func.__name__,
+                    message.from_user.id,
+                )
+                return
+            if delay:
+                await asyncio.sleep(delay)
 
-            user_cooldowns[user_id] = current_time
             return await func(message, *args, **kwargs)
 
         return wrapper
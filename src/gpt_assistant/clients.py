@@ -0,0 +1,77 @@
+from logging import getLogger
+from typing import Dict, Optional
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from g4f import Provider
+from g4f.client import AsyncClient
+
+from gpt_assistant import settings
+
+logger = getLogger(__name__)
+
+
+class ClientPool:
+    """Long-lived HTTP session and g4f clients shared by every handler."""
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        dns_ttl: int = 300,
+        timeout: float = 60.0,
+    ):
+        """
+        :param limit: Maximum number of simultaneous connections.
+        :param limit_per_host: Maximum number of simultaneous connections to one host.
+        :param dns_ttl: Seconds DNS lookups are cached for.
+        :param timeout: Total timeout of a single HTTP request.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.timeout = timeout
+
+        self._session: Optional[ClientSession] = None
+        self._clients: Dict[str, AsyncClient] = {}
+
+    @property
+    def http(self) -> ClientSession:
+        # opened on first use as well, since a ClientSession must live inside the event loop
+        if self._session is None or self._session.closed:
+            self._open()
+        return self._session
+
+    def _open(self) -> None:
+        self._session = ClientSession(
+            connector=TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=30,
+            ),
+            timeout=ClientTimeout(total=self.timeout),
+        )
+
+    def g4f(self, provider_name: str) -> AsyncClient:
+        """Returns the cached client for ``provider_name``, serving both chat and images."""
+        client = self._clients.get(provider_name)
+        if client is None:
+            client = self._clients[provider_name] = AsyncClient(getattr(Provider, provider_name))
+        return client
+
+    async def start(self) -> None:
+        if self._session is None or self._session.closed:
+            self._open()
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._clients.clear()
+        logger.debug("Client pool closed")
+
+
+client_pool = ClientPool(
+    limit=settings.HTTP_POOL_SIZE,
+    limit_per_host=settings.HTTP_POOL_SIZE_PER_HOST,
+)
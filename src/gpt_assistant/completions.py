@@ -0,0 +1,37 @@
+import hashlib
+import json
+from typing import Dict, List, Optional
+
+from gpt_assistant import settings
+from gpt_assistant.cache import LRUCache
+
+
+class CompletionCache(LRUCache):
+    """Answers keyed by a hash of the exact prompt payload, provider and model."""
+
+    def __init__(self, maxsize: int = 5_000, ttl: Optional[float] = 3600.0):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.bytes_saved = 0
+
+    @staticmethod
+    def make_key(messages: List[Dict[str, str]], provider: str, model: str) -> str:
+        payload = json.dumps(
+            [provider, model.lower(), messages], ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key, default=None, count: bool = True):
+        value = super().get(key, default, count)
+        if count and value is not default:
+            self.bytes_saved += len(value.encode())
+        return value
+
+    def stats(self) -> Dict[str, float]:
+        stats = super().stats()
+        stats["bytes_saved"] = self.bytes_saved
+        return stats
+
+
+completion_cache = CompletionCache(
+    maxsize=settings.COMPLETION_CACHE_SIZE, ttl=settings.COMPLETION_CACHE_TTL
+)
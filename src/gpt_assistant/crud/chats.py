@@ -1,16 +1,23 @@
-from logging import getLogger
+from logging import DEBUG, getLogger
 from typing import List, Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from gpt_assistant import settings
+from gpt_assistant.cache import IdSet
+from gpt_assistant.metrics import track_crud
 from utils import stringify_attributes
 
 from ..db import *
 
 logger = getLogger(__name__)
 
+# Chat ids known to exist in the ``chats`` table.
+known_chats = IdSet(maxsize=settings.MEMBERSHIP_CACHE_SIZE)
 
+
+@track_crud
 async def register_chat(session: AsyncSession, chat_id: int) -> Chat:
     logger.debug("Registering chat: %s", chat_id)
 
@@ -19,11 +26,13 @@ async def register_chat(session: AsyncSession, chat_id: int) -> Chat:
 
     await session.commit()
     await session.refresh(new_chat)
+    known_chats.add(new_chat.chat_id)
 
     logger.debug("Chat registered successfully: %s", chat_id)
     return new_chat
 
 
+@track_crud
 async def delete_chat(session: AsyncSession, chat_id: int) -> bool:
     logger.debug("Attempting to delete chat: %s", chat_id)
 
@@ -33,6 +42,7 @@ async def delete_chat(session: AsyncSession, chat_id: int) -> bool:
     if chat:
         await session.delete(chat)
         await session.commit()
+        known_chats.discard(chat_id)
         logger.debug("Chat deleted successfully: %s", chat_id)
         return True
 
@@ -40,6 +50,7 @@ async def delete_chat(session: AsyncSession, chat_id: int) -> bool:
     return False
 
 
+@track_crud
 async def get_chat(session: AsyncSession, chat_id: int) -> Chat:
 
     result = await session.execute(select(Chat).where(Chat.chat_id == chat_id))
@@ -49,6 +60,25 @@ async def get_chat(session: AsyncSession, chat_id: int) -> Chat:
     if not chat:
         logger.debug("Chat with id: %d not found", chat_id)
     else:
-        logger.debug("Chat found: %s", stringify_attributes(chat))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("Chat found: %s", stringify_attributes(chat))
 
     return chat
+
+
+@track_crud
+async def ensure_chat(session: AsyncSession, chat_id: int) -> None:
+    """Inserts the chat unless it already exists. The caller commits."""
+    await session.execute(insert_ignore(Chat).values(chat_id=chat_id))
+
+
+@track_crud
+async def warm_known_chats(session: AsyncSession) -> int:
+    result = await session.stream_scalars(
+        select(Chat.chat_id).limit(known_chats.maxsize)
+    )
+    async for chat_id in result:
+        known_chats.add(chat_id)
+
+    logger.debug("Warmed %d known chats", len(known_chats))
+    return len(known_chats)
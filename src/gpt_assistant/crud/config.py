@@ -4,11 +4,19 @@ from sqlalchemy import and_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from gpt_assistant import settings
+from gpt_assistant.cache import LRUCache
 from gpt_assistant.db.models import Config
+from gpt_assistant.metrics import track_crud
 
 logger = getLogger(__name__)
 
+# Write-through cache of Config rows keyed by (chat_id, user_id). Entries are
+# detached ORM objects and must be treated as read-only by callers.
+config_cache = LRUCache(maxsize=settings.CONFIG_CACHE_SIZE, ttl=settings.CONFIG_CACHE_TTL)
 
+
+@track_crud
 async def register_config(session: AsyncSession, chat_id: int, **kwargs) -> Config:
 
     new_config = Config(chat_id=chat_id, **kwargs)
@@ -17,13 +25,20 @@ async def register_config(session: AsyncSession, chat_id: int, **kwargs) -> Conf
     await session.commit()
     await session.refresh(new_config)
 
+    config_cache.set((chat_id, new_config.user_id), new_config)
+
     logger.debug("Config registered successfully for chat: %s", chat_id)
     return new_config
 
 
+@track_crud
 async def get_config(
     session: AsyncSession, chat_id: int, user_id: int
 ) -> Config | None:
+    config = config_cache.get((chat_id, user_id))
+    if config is not None:
+        return config
+
     logger.debug("Fetching config for chat: %s", chat_id)
 
     result = await session.execute(
@@ -32,6 +47,7 @@ async def get_config(
     config = result.scalars().first()
 
     if config:
+        config_cache.set((chat_id, user_id), config)
         logger.debug("Config found for chat: %s", chat_id)
     else:
         logger.debug("No config found for chat: %s", chat_id)
@@ -39,6 +55,7 @@ async def get_config(
     return config
 
 
+@track_crud
 async def update_config(
     session: AsyncSession,
     chat_id: int,
@@ -53,8 +70,14 @@ async def update_config(
         for k, v in kwargs.items():
             setattr(config, k, v)
 
-        await session.commit()
+        try:
+            await session.commit()
+        except Exception:
+            config_cache.pop((chat_id, user_id))
+            raise
+
+        config_cache.set((chat_id, user_id), config)
         logger.debug("Config updated successfully for chat: %s", chat_id)
         return True
 
-    await register_config(session, chat_id, **kwargs)
+    await register_config(session, chat_id, user_id=user_id, **kwargs)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+from logging import getLogger
+from typing import List, Optional
+
+from sqlalchemy import and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from gpt_assistant.cache import LRUCache
+from gpt_assistant.metrics import track_crud
+
+from ..db import *
+
+logger = getLogger(__name__)
+
+# Output file ids by (prompt_key, image_model, input_file_hash), in front of the table
+generation_cache = LRUCache(maxsize=10_000, ttl=24 * 60 * 60)
+
+
+def make_prompt_key(prompt: str) -> str:
+    normalized = " ".join(prompt.lower().split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def _file_ids(output_file_hashes) -> List[str]:
+    # legacy rows, written before this was fixed, hold the list JSON-encoded a second time
+    if isinstance(output_file_hashes, str):
+        return json.loads(output_file_hashes)
+    return list(output_file_hashes or [])
+
+
+@track_crud
+async def add_image_generation(
+    session: AsyncSession, output_file_hashes: List[str], **kwargs
+) -> ImageGeneration:
+    kwargs.setdefault("prompt_key", make_prompt_key(kwargs["prompt"]))
+
+    # the column is JSON already, the list is stored as-is
+    image_generation = ImageGeneration(output_file_hashes=list(output_file_hashes), **kwargs)
+    session.add(image_generation)
+    await session.commit()
+
+    if output_file_hashes:
+        key = (kwargs["prompt_key"], kwargs.get("image_model"), kwargs.get("input_file_hash"))
+        generation_cache.set(key, list(output_file_hashes))
+
+    logger.debug("Image generation stored for chat: %s", kwargs.get("chat_id"))
+    return image_generation
+
+
+@track_crud
+async def find_image_generation(
+    session: AsyncSession,
+    prompt: str,
+    image_model: str,
+    input_file_hash: Optional[str] = None,
+) -> Optional[List[str]]:
+    """Returns the Telegram file ids of an earlier generation of the same request."""
+    prompt_key = make_prompt_key(prompt)
+    key = (prompt_key, image_model, input_file_hash)
+
+    file_ids = generation_cache.get(key)
+    if file_ids is not None:
+        return file_ids
+
+    if input_file_hash is None:
+        input_condition = ImageGeneration.input_file_hash.is_(None)
+    else:
+        input_condition = ImageGeneration.input_file_hash == input_file_hash
+
+    result = await session.execute(
+        select(ImageGeneration.output_file_hashes)
+        .where(
+            and_(
+                ImageGeneration.prompt_key == prompt_key,
+                ImageGeneration.image_model == image_model,
+                input_condition,
+            )
+        )
+        .order_by(ImageGeneration.created_at.desc(), ImageGeneration._id.desc())
+        .limit(1)
+    )
+    output_file_hashes = result.scalar()
+    if output_file_hashes is None:
+        return None
+
+    file_ids = _file_ids(output_file_hashes)
+    if file_ids:
+        generation_cache.set(key, file_ids)
+    logger.debug("Reusing %d generated images for chat prompt %s", len(file_ids), prompt_key)
+    return file_ids or None
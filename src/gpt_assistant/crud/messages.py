@@ -1,26 +1,47 @@
-from logging import getLogger
+from logging import DEBUG, getLogger
 from typing import List, Optional
 
-from sqlalchemy import and_
+from sqlalchemy import and_, func, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from utils import stringify_attributes
+from gpt_assistant import settings
+from gpt_assistant.metrics import track_crud
+from utils import estimate_tokens, stringify_attributes
 
 from ..db import *
+from ..db.writer import WriteBehindQueue
 
 logger = getLogger(__name__)
 
+message_writer = WriteBehindQueue(
+    Message,
+    batch_size=settings.MESSAGE_WRITE_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_WRITE_INTERVAL,
+    maxsize=settings.MESSAGE_WRITE_QUEUE_SIZE,
+    key=lambda values: (values["chat_id"], values["author_id"]),
+)
 
+
+@track_crud
 async def add_message(session: AsyncSession, **kwargs) -> Message:
+    kwargs.setdefault("token_count", estimate_tokens(kwargs.get("content")))
     new_message = Message(**kwargs)
     session.add(new_message)
     await session.commit()
     await session.refresh(new_message)
-    logger.debug("Message added: %s", stringify_attributes(new_message))
+    if logger.isEnabledFor(DEBUG):
+        logger.debug("Message added: %s", stringify_attributes(new_message))
     return new_message
 
 
+async def queue_message(**kwargs) -> None:
+    """Like :func:`add_message`, but written in the background by ``message_writer``."""
+    kwargs.setdefault("token_count", estimate_tokens(kwargs.get("content")))
+    await message_writer.put(**kwargs)
+
+
+@track_crud
 async def remove_message(session: AsyncSession, message_id: int) -> bool:
     result = await session.execute(
         select(Message).filter(Message.message_id == message_id)
@@ -28,16 +49,19 @@ async def remove_message(session: AsyncSession, message_id: int) -> bool:
     message = result.scalars().first()
 
     if message:
-        logger.debug("Message found, deleting: %s", stringify_attributes(message))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("Message found, deleting: %s", stringify_attributes(message))
         await session.delete(message)
         await session.commit()
-        logger.debug("Message deleted: %s", stringify_attributes(message))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("Message deleted: %s", stringify_attributes(message))
         return True
     else:
         logger.debug("Message with _id %d not found", message_id)
         return False
 
 
+@track_crud
 async def get_message(session: AsyncSession, message_id: int) -> Optional[Message]:
     result = await session.execute(
         select(Message).filter(Message.message_id == message_id)
@@ -45,34 +69,150 @@ async def get_message(session: AsyncSession, message_id: int) -> Optional[Messag
     message = result.scalars().first()
 
     if message:
-        logger.debug("Message found: %s", stringify_attributes(message))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("Message found: %s", stringify_attributes(message))
     else:
         logger.debug("Message with _id %d not found", message_id)
 
     return message
 
 
+def message_tokens(message: Message) -> int:
+    if message.token_count is not None:
+        return message.token_count
+    return estimate_tokens(message.content)
+
+
+def truncate_turn(turn: List[Message], token_budget: int) -> List[Message]:
+    """Shrinks the messages of ``turn`` so they add up to about ``token_budget``.
+
+    The budget is shared fairly: messages smaller than their share are kept
+    whole and what they leave over goes to the larger ones. Returns detached
+    copies, the session's rows are left untouched.
+    """
+    allowed = {}
+    remaining = token_budget
+    by_size = sorted(turn, key=message_tokens)
+    for index, message in enumerate(by_size):
+        share = max(remaining // (len(by_size) - index), 0)
+        allowed[id(message)] = min(message_tokens(message), share)
+        remaining -= allowed[id(message)]
+
+    truncated = []
+    for message in turn:
+        tokens = allowed[id(message)]
+        content = message.content
+        if tokens < message_tokens(message):
+            # the inverse of estimate_tokens
+            content = content[: tokens * 4].rstrip() + "…"
+        truncated.append(
+            Message(
+                content=content,
+                message_id=message.message_id,
+                author_id=message.author_id,
+                chat_id=message.chat_id,
+                role=message.role,
+                model=message.model,
+                token_count=tokens,
+            )
+        )
+    return truncated
+
+
+def fit_turns(messages: List[Message], token_budget: int) -> List[Message]:
+    """Keeps the newest whole turns of ``messages`` (newest first) that fit in
+    ``token_budget``.
+
+    A turn is the question and the answer stored under one ``message_id``, so
+    an answer is never sent without its question. The latest turn is always
+    kept, truncated if it doesn't fit on its own.
+    """
+    turns: List[List[Message]] = []
+    for message in messages:
+        if turns and turns[-1][0].message_id == message.message_id:
+            turns[-1].append(message)
+        else:
+            turns.append([message])
+
+    kept: List[Message] = []
+    used = 0
+    for index, turn in enumerate(turns):
+        if not any(message.role == "user" for message in turn):
+            # cut off from its question by the row limit
+            break
+
+        tokens = sum(message_tokens(message) for message in turn)
+        if index == 0 and tokens > token_budget:
+            return truncate_turn(turn, token_budget)
+        if used + tokens > token_budget:
+            break
+
+        kept += turn
+        used += tokens
+
+    return kept
+
+
+@track_crud
 async def get_messages(
     session: AsyncSession,
     chat_id: int,
     user_id: int,
     model: str,
     limit: Optional[int] = 30,
+    token_budget: Optional[int] = None,
 ) -> List[Message]:
-    result = await session.execute(
-        select(Message)
-        .filter(
-            and_(
-                Message.chat_id == chat_id,
-                Message.author_id == user_id,
-                Message.model == model.lower(),
+    """Returns the newest messages first.
+
+    With ``token_budget`` set, only the newest whole turns whose token counts
+    add up to at most the budget are returned (see :func:`fit_turns`), still
+    capped at ``limit`` rows.
+    """
+    await message_writer.flush_pending((chat_id, user_id))
+
+    newest_first = (Message.created_at.desc(), Message._id.desc())
+    condition = and_(
+        Message.chat_id == chat_id,
+        Message.author_id == user_id,
+        Message.model == model.lower(),
+    )
+
+    if token_budget is None:
+        query = select(Message).filter(condition).order_by(*newest_first).limit(limit)
+    else:
+        # rows written before token counts existed fall back to an estimate
+        tokens = func.coalesce(Message.token_count, (func.length(Message.content) + 3) // 4)
+        window = (
+            select(
+                Message._id,
+                (func.sum(tokens).over(order_by=newest_first) - tokens).label("tokens_before"),
+                func.first_value(Message.message_id).over(order_by=newest_first).label("latest_turn"),
             )
+            .filter(condition)
+            .order_by(*newest_first)
+            .limit(limit)
+            .subquery()
         )
-        .order_by(Message.created_at.desc())
-        .limit(limit)
-    )
+        # the rows starting within the budget, which include the one crossing
+        # it, and the whole latest turn; fit_turns cuts them to whole turns
+        query = (
+            select(Message)
+            .join(window, Message._id == window.c._id)
+            .filter(
+                or_(
+                    window.c.tokens_before < token_budget,
+                    Message.message_id == window.c.latest_turn,
+                )
+            )
+            .order_by(*newest_first)
+        )
+
+    result = await session.execute(query)
     messages = result.scalars().all()
 
+    if token_budget is not None:
+        messages = fit_turns(messages, token_budget)
+
     if messages:
         logger.debug(
             "Found %d messages for chat_id %d and user_id: %d",
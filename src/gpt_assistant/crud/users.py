@@ -1,44 +1,76 @@
-from logging import getLogger
+from logging import DEBUG, getLogger
 from typing import Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from gpt_assistant import settings
+from gpt_assistant.cache import IdSet
+from gpt_assistant.metrics import track_crud
 from utils import stringify_attributes
 
 from ..db import *
 
 logger = getLogger(__name__)
 
+# User ids known to exist in the ``users`` table.
+known_users = IdSet(maxsize=settings.MEMBERSHIP_CACHE_SIZE)
 
+
+@track_crud
 async def register_user(session: AsyncSession, user_id: int) -> User:
     new_user = User(user_id=int(user_id))
     session.add(new_user)
     await session.commit()
     await session.refresh(new_user)
-    logger.debug("User created: %s", stringify_attributes(new_user))
+    known_users.add(new_user.user_id)
+    if logger.isEnabledFor(DEBUG):
+        logger.debug("User created: %s", stringify_attributes(new_user))
     return new_user
 
 
+@track_crud
 async def delete_user(session: AsyncSession, user_id: int):
     result = await session.execute(select(User).where(User.user_id == user_id))
     user = result.scalars().first()
 
     if user:
-        logger.debug("User deleted: %s", stringify_attributes(user))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("User deleted: %s", stringify_attributes(user))
         session.delete(user)
         await session.commit()
+        known_users.discard(user_id)
     else:
         logger.debug("User not found for deletion: user_id %d", user_id)
 
 
+@track_crud
 async def get_user(session: AsyncSession, user_id: int) -> Optional[User]:
     result = await session.execute(select(User).where(User.user_id == int(user_id)))
     user = result.scalars().first()
 
     if user:
-        logger.debug("User retrieved: %s", stringify_attributes(user))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug("User retrieved: %s", stringify_attributes(user))
     else:
         logger.debug("User not found: user_id %d", user_id)
 
     return user
+
+
+@track_crud
+async def ensure_user(session: AsyncSession, user_id: int) -> None:
+    """Inserts the user unless it already exists. The caller commits."""
+    await session.execute(insert_ignore(User).values(user_id=int(user_id)))
+
+
+@track_crud
+async def warm_known_users(session: AsyncSession) -> int:
+    result = await session.stream_scalars(
+        select(User.user_id).limit(known_users.maxsize)
+    )
+    async for user_id in result:
+        known_users.add(user_id)
+
+    logger.debug("Warmed %d known users", len(known_users))
+    return len(known_users)
@@ -1,2 +1,3 @@
 from .models import *
-from .session import SessionLocal, engine, init_db
+from .querycount import QueryCount, count_queries
+from .session import SessionLocal, engine, init_db, insert_ignore
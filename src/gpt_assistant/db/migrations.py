@@ -0,0 +1,104 @@
+from logging import getLogger
+from typing import Callable, List, Tuple
+
+from sqlalchemy import (TIMESTAMP, Column, Connection, Integer, MetaData,
+                        Table, Text, func, insert, inspect, select)
+
+from .models import Base
+
+logger = getLogger(__name__)
+
+Migration = Tuple[int, str, Callable[[Connection], None]]
+
+MIGRATIONS: List[Migration] = []
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", Text, nullable=False),
+    Column("applied_at", TIMESTAMP, server_default=func.now()),
+)
+
+
+def migration(version: int, name: str):
+    """Registers a schema migration. Versions are applied in ascending order, once."""
+
+    def decorator(func: Callable[[Connection], None]):
+        if any(v == version for v, _, _ in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version: {version}")
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+
+    return decorator
+
+
+def create_index(conn: Connection, table_name: str, index_name: str) -> None:
+    table = Base.metadata.tables[table_name]
+    index = next(index for index in table.indexes if index.name == index_name)
+    index.create(conn, checkfirst=True)
+
+
+def add_column(conn: Connection, table_name: str, column_name: str) -> bool:
+    """Adds a column declared on the model if the table does not have it yet."""
+    existing = {column["name"] for column in inspect(conn).get_columns(table_name)}
+    if column_name in existing:
+        return False
+
+    column = Base.metadata.tables[table_name].c[column_name]
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.exec_driver_sql(
+        f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"
+    )
+    return True
+
+
+def run_migrations(conn: Connection) -> List[int]:
+    """Applies pending migrations on a synchronous connection, see ``init_db``."""
+    schema_migrations.create(conn, checkfirst=True)
+    applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+    done = []
+    for version, name, apply in MIGRATIONS:
+        if version in applied:
+            continue
+
+        logger.info("Applying migration %d: %s", version, name)
+        apply(conn)
+        conn.execute(insert(schema_migrations).values(version=version, name=name))
+        done.append(version)
+
+    return done
+
+
+# Migrations must stay idempotent: on a fresh database ``create_all`` has
+# already produced the latest schema before they run.
+
+
+@migration(1, "messages and image_generations indexes")
+def _add_lookup_indexes(conn: Connection) -> None:
+    for index_name in ("ix_messages_history", "ix_messages_last_file", "ix_messages_author"):
+        create_index(conn, "messages", index_name)
+    create_index(conn, "image_generations", "ix_image_generations_chat_author")
+
+
+@migration(2, "messages.token_count")
+def _add_message_token_count(conn: Connection) -> None:
+    if add_column(conn, "messages", "token_count"):
+        conn.exec_driver_sql(
+            "UPDATE messages SET token_count = (length(content) + 3) / 4 "
+            "WHERE token_count IS NULL"
+        )
+
+
+@migration(3, "image_generations.image_model, prompt_key and lookup index")
+def _add_image_generation_lookup(conn: Connection) -> None:
+    add_column(conn, "image_generations", "image_model")
+    add_column(conn, "image_generations", "prompt_key")
+    create_index(conn, "image_generations", "ix_image_generations_lookup")
+
+
+@migration(4, "config.completion_cache")
+def _add_config_completion_cache(conn: Connection) -> None:
+    add_column(conn, "config", "completion_cache")
@@ -2,7 +2,7 @@ from enum import Enum as PyEnum
 from typing import List, Tuple
 
 from sqlalchemy import (JSON, TIMESTAMP, BigInteger, Boolean, Enum, ForeignKey,
-                        Text, UniqueConstraint, func)
+                        Index, Integer, Text, UniqueConstraint, func, text)
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
@@ -16,14 +16,33 @@ __all__: Tuple[str, ...] = (
 )
 
 
+# SQLite only auto-increments columns declared exactly as INTEGER PRIMARY KEY.
+BigIntegerPK = BigInteger().with_variant(Integer, "sqlite")
+
+
 class Base(AsyncAttrs, DeclarativeBase):
     pass
 
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # get_messages: history of one author in one chat for one model
+        Index("ix_messages_history", "chat_id", "author_id", "model", "created_at"),
+        # ask_command: latest attached file of one author in one chat
+        Index(
+            "ix_messages_last_file",
+            "chat_id",
+            "author_id",
+            "created_at",
+            postgresql_where=text("file_hash IS NOT NULL"),
+            sqlite_where=text("file_hash IS NOT NULL"),
+        ),
+        # clear_history: count/delete everything of one author
+        Index("ix_messages_author", "author_id"),
+    )
 
-    _id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    _id: Mapped[int] = mapped_column(BigIntegerPK, primary_key=True, autoincrement=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     message_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     author_id: Mapped[int] = mapped_column(
@@ -35,6 +54,7 @@ class Message(Base):
     role: Mapped[str] = mapped_column(Text, nullable=False)
     model: Mapped[str] = mapped_column(Text, nullable=False)
     file_hash: Mapped[str] = mapped_column(Text, nullable=True)
+    token_count: Mapped[int] = mapped_column(Integer, nullable=True)
     created_at: Mapped["TIMESTAMP"] = mapped_column(
         TIMESTAMP, server_default=func.now()
     )
@@ -42,8 +62,19 @@ class Message(Base):
 
 class ImageGeneration(Base):
     __tablename__ = "image_generations"
+    __table_args__ = (
+        Index("ix_image_generations_chat_author", "chat_id", "author_id", "created_at"),
+        # imagine_command: earlier generation of the same prompt/model/input
+        Index(
+            "ix_image_generations_lookup",
+            "prompt_key",
+            "image_model",
+            "input_file_hash",
+            "created_at",
+        ),
+    )
 
-    _id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    _id: Mapped[int] = mapped_column(BigIntegerPK, primary_key=True, autoincrement=True)
     prompt: Mapped[str] = mapped_column(Text, nullable=False)
     message_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     author_id: Mapped[int] = mapped_column(
@@ -53,6 +84,8 @@ class ImageGeneration(Base):
         ForeignKey("chats.chat_id", ondelete="CASCADE"), nullable=False
     )
     input_file_hash: Mapped[str] = mapped_column(Text, nullable=True)
+    image_model: Mapped[str] = mapped_column(Text, nullable=True)
+    prompt_key: Mapped[str] = mapped_column(Text, nullable=True)
     output_file_hashes: Mapped[List[str]] = mapped_column(JSON, nullable=False)
     created_at: Mapped["TIMESTAMP"] = mapped_column(
         TIMESTAMP, server_default=func.now()
@@ -63,7 +96,7 @@ class Config(Base):
     __tablename__ = "config"
     __table_args__ = (UniqueConstraint("chat_id", "user_id"),)
 
-    _id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    _id: Mapped[int] = mapped_column(BigIntegerPK, primary_key=True, autoincrement=True)
     chat_id: Mapped[int] = mapped_column(
         ForeignKey("chats.chat_id", ondelete="CASCADE"), nullable=False
     )
@@ -75,6 +108,8 @@ class Config(Base):
     provider: Mapped[str] = mapped_column(Text, nullable=False)
     instructions: Mapped[str] = mapped_column(Text, nullable=True)
     streaming: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    # NULL on rows created before the column existed, read as enabled
+    completion_cache: Mapped[bool] = mapped_column(Boolean, nullable=True, default=True)
     created_at: Mapped["TIMESTAMP"] = mapped_column(
         TIMESTAMP, server_default=func.now()
     )
@@ -83,7 +118,7 @@ class Config(Base):
 class User(Base):
     __tablename__ = "users"
 
-    _id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    _id: Mapped[int] = mapped_column(BigIntegerPK, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
     created_at: Mapped["TIMESTAMP"] = mapped_column(
         TIMESTAMP, server_default=func.now()
@@ -93,7 +128,7 @@ class User(Base):
 class Chat(Base):
     __tablename__ = "chats"
 
-    _id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    _id: Mapped[int] = mapped_column(BigIntegerPK, primary_key=True, autoincrement=True)
     chat_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
     created_at: Mapped["TIMESTAMP"] = mapped_column(
         TIMESTAMP, server_default=func.now()
@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_current_count: ContextVar[Optional["QueryCount"]] = ContextVar("current_query_count", default=None)
+
+
+class QueryCount:
+    """Statements and round trips made while the count is active, see :func:`count_queries`.
+
+    Round trips are the statements plus the commits and rollbacks, each of
+    which waits on the database as well.
+    """
+
+    __slots__ = ("parent", "statements", "round_trips", "queries")
+
+    def __init__(self, parent: Optional["QueryCount"] = None, record: bool = False):
+        """
+        :param parent: Enclosing count, which sees everything this one sees.
+        :param record: Keep the SQL of every statement in ``queries``.
+        """
+        self.parent = parent
+        self.statements = 0
+        self.round_trips = 0
+        self.queries: Optional[List[str]] = [] if record else None
+
+
+@contextmanager
+def count_queries(record: bool = False) -> Iterator[QueryCount]:
+    """Counts the queries made by the current task, and the tasks it starts, in the block.
+
+    Counts nest: an outer count includes the queries of the inner ones.
+    """
+    count = QueryCount(_current_count.get(), record)
+    token = _current_count.set(count)
+    try:
+        yield count
+    finally:
+        _current_count.reset(token)
+
+
+def _on_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    count = _current_count.get()
+    while count is not None:
+        count.statements += 1
+        count.round_trips += 1
+        if count.queries is not None:
+            count.queries.append(statement)
+        count = count.parent
+
+
+def _on_transaction_end(conn) -> None:
+    count = _current_count.get()
+    while count is not None:
+        count.round_trips += 1
+        count = count.parent
+
+
+def install(engine: Engine) -> None:
+    """Hooks the counting into ``engine``, the ``sync_engine`` of an async engine.
+
+    Listeners run inside the calling task's context (SQLAlchemy carries it
+    into its greenlets), and cost a context variable lookup when nothing is
+    being counted.
+    """
+    event.listen(engine, "before_cursor_execute", _on_statement)
+    event.listen(engine, "commit", _on_transaction_end)
+    event.listen(engine, "rollback", _on_transaction_end)
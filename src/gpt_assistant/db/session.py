@@ -1,18 +1,45 @@
 from logging import getLogger
 
+from sqlalchemy import Insert, insert
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 from .. import settings
+from . import querycount
+from .migrations import run_migrations
 from .models import Base
 
 logger = getLogger(__name__)
 
-engine = create_async_engine(settings.DATABASE_URL, echo=True)
+engine = create_async_engine(settings.DATABASE_URL, echo=settings.SQL_ECHO)
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+querycount.install(engine.sync_engine)
+
+
+def insert_ignore(model) -> Insert:
+    """Builds an ``INSERT`` that silently skips rows violating a unique constraint."""
+    dialect = engine.dialect.name
+
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+        return pg_insert(model).on_conflict_do_nothing()
+
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+        return sqlite_insert(model).on_conflict_do_nothing()
+
+    if dialect in ("mysql", "mariadb"):
+        return insert(model).prefix_with("IGNORE")
+
+    return insert(model)
 
 
 async def init_db():
     logger.debug("Initializing the db...")
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        applied = await conn.run_sync(run_migrations)
+    if applied:
+        logger.info("Applied migrations: %s", applied)
     logger.info("DB initialization was successfull!")
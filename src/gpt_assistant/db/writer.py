@@ -0,0 +1,155 @@
+import asyncio
+from collections import Counter
+from contextvars import Context
+from logging import getLogger
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from sqlalchemy import insert
+
+from .session import SessionLocal
+
+logger = getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Buffers rows in memory and inserts them in multi-row batches.
+
+    Rows are flushed once ``batch_size`` of them are waiting or
+    ``flush_interval`` seconds after the first one was queued, whichever comes
+    first. ``put`` applies backpressure when ``maxsize`` rows are pending.
+    """
+
+    def __init__(
+        self,
+        model,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        maxsize: int = 10_000,
+        key: Optional[Callable[[Dict[str, Any]], Hashable]] = None,
+    ):
+        """
+        :param model: ORM model the rows are inserted into.
+        :param batch_size: Maximum number of rows per INSERT.
+        :param flush_interval: Maximum seconds a row waits before being written.
+        :param maxsize: Maximum number of pending rows.
+        :param key: Optional function grouping rows, see :meth:`flush_pending`.
+        """
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self.key = key
+
+        self.batches = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._pending: Counter = Counter()
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": len(self),
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+        }
+
+    def start(self) -> None:
+        if self._worker and not self._worker.done():
+            return
+
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+        # a fresh context, the writes aren't part of the update that happened to start the worker
+        self._worker = asyncio.create_task(self._run(), context=Context())
+
+    async def put(self, **values) -> None:
+        self.start()
+        if self.key:
+            self._pending[self.key(values)] += 1
+        await self._queue.put(values)
+
+    async def flush(self) -> None:
+        """Waits until every row queued so far has been written."""
+        if self._queue is None:
+            return
+        self.start()
+        await self._queue.join()
+
+    async def flush_pending(self, key: Hashable) -> None:
+        """Flushes only if rows matching ``key`` are still pending."""
+        if self._pending.get(key):
+            await self.flush()
+
+    async def stop(self) -> None:
+        await self.flush()
+
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write(batch)
+            finally:
+                for values in batch:
+                    if self.key:
+                        key = self.key(values)
+                        self._pending[key] -= 1
+                        if self._pending[key] <= 0:
+                            del self._pending[key]
+                    self._queue.task_done()
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            async with SessionLocal() as session:
+                await session.execute(insert(self.model), batch)
+                await session.commit()
+        except Exception:
+            logger.exception(
+                "Batch insert of %d %s rows failed, retrying one by one",
+                len(batch),
+                self.model.__tablename__,
+            )
+            await self._write_each(batch)
+            return
+
+        self.batches += 1
+        self.rows_written += len(batch)
+        logger.debug("Wrote %d %s rows", len(batch), self.model.__tablename__)
+
+    async def _write_each(self, batch: List[Dict[str, Any]]) -> None:
+        for values in batch:
+            try:
+                async with SessionLocal() as session:
+                    await session.execute(insert(self.model).values(**values))
+                    await session.commit()
+            except Exception:
+                self.rows_failed += 1
+                logger.exception("Dropping %s row: %s", self.model.__tablename__, values)
+            else:
+                self.rows_written += 1
@@ -0,0 +1,301 @@
+import asyncio
+import time
+from collections import deque
+from logging import getLogger
+from typing import (Awaitable, Callable, Dict, Iterable, List, Optional, Tuple,
+                    TypeVar)
+
+from gpt_assistant import settings
+from gpt_assistant.metrics import provider_latency, providers_in_flight
+from gpt_assistant.tracing import tracer
+
+logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderStats:
+    """Rolling latency and outcome window of one (provider, model) pair."""
+
+    __slots__ = ("latencies", "outcomes", "consecutive_failures", "state", "opened_until")
+
+    def __init__(self, window: int):
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_until = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ProviderHealth:
+    """Tracks provider health and runs requests with failover and optional hedging.
+
+    A circuit opens after ``failure_threshold`` consecutive failures, or once
+    the error rate over the last ``window`` calls reaches ``error_rate_threshold``
+    (with at least ``min_samples`` calls). After ``open_seconds`` a single
+    trial request is let through (half-open); its outcome closes or re-opens
+    the circuit. At most ``max_in_flight`` requests run on one provider at a
+    time, the others wait for a slot. ``timeouts`` overrides the deadline of
+    an attempt by ``"provider/model"``, ``"provider"`` or ``"model"``. A
+    provider without latency history is hedged after ``hedge_cold_delay``,
+    or half its deadline if that is sooner.
+    """
+
+    def __init__(
+        self,
+        window: int = 50,
+        failure_threshold: int = 5,
+        error_rate_threshold: float = 0.5,
+        min_samples: int = 10,
+        open_seconds: float = 60.0,
+        max_in_flight: Optional[int] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        hedge_cold_delay: float = 10.0,
+    ):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.open_seconds = open_seconds
+        self.max_in_flight = max_in_flight
+        self.timeouts = timeouts or {}
+        self.hedge_cold_delay = hedge_cold_delay
+        self._stats: Dict[Tuple[str, str], ProviderStats] = {}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+
+    def stats(self, provider: str, model: str) -> ProviderStats:
+        key = (provider, model)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = ProviderStats(self.window)
+        return stats
+
+    def snapshot(self) -> Dict[Tuple[str, str], Dict[str, object]]:
+        return {
+            key: {
+                "state": stats.state,
+                "calls": len(stats.outcomes),
+                "error_rate": stats.error_rate,
+                "p50": stats.percentile(0.5),
+                "p95": stats.percentile(0.95),
+            }
+            for key, stats in self._stats.items()
+        }
+
+    def available(self, provider: str, model: str) -> bool:
+        stats = self.stats(provider, model)
+        return stats.state == CLOSED or time.monotonic() >= stats.opened_until
+
+    def acquire(self, provider: str, model: str) -> None:
+        """Marks a request as started; on an open circuit it becomes the trial request."""
+        stats = self.stats(provider, model)
+        if stats.state != CLOSED:
+            # other requests keep skipping the provider while the trial runs
+            stats.state = HALF_OPEN
+            stats.opened_until = time.monotonic() + self.open_seconds
+
+    def record_success(self, provider: str, model: str, latency: float) -> None:
+        provider_latency.observe(provider, model, "ok", value=latency)
+        stats = self.stats(provider, model)
+        stats.latencies.append(latency)
+        stats.outcomes.append(True)
+        stats.consecutive_failures = 0
+
+        if stats.state != CLOSED:
+            logger.info("Circuit of %s/%s closed", provider, model)
+            stats.state = CLOSED
+
+    def record_failure(self, provider: str, model: str, latency: float) -> None:
+        provider_latency.observe(provider, model, "error", value=latency)
+        stats = self.stats(provider, model)
+        stats.outcomes.append(False)
+        stats.consecutive_failures += 1
+
+        tripped = (
+            stats.state == HALF_OPEN
+            or stats.consecutive_failures >= self.failure_threshold
+            or (
+                len(stats.outcomes) >= self.min_samples
+                and stats.error_rate >= self.error_rate_threshold
+            )
+        )
+        if tripped:
+            if stats.state != OPEN:
+                logger.warning(
+                    "Circuit of %s/%s opened (error rate %.0f%%)",
+                    provider,
+                    model,
+                    stats.error_rate * 100,
+                )
+            stats.state = OPEN
+            stats.opened_until = time.monotonic() + self.open_seconds
+
+    def slots(self, provider: str) -> Optional[asyncio.Semaphore]:
+        if self.max_in_flight is None:
+            return None
+        slots = self._slots.get(provider)
+        if slots is None:
+            slots = self._slots[provider] = asyncio.Semaphore(self.max_in_flight)
+        return slots
+
+    def timeout_for(self, provider: str, model: str, default: Optional[float]) -> Optional[float]:
+        for key in (f"{provider}/{model}", provider, model):
+            if key in self.timeouts:
+                return self.timeouts[key]
+        return default
+
+    async def _attempt(
+        self,
+        provider: str,
+        model: str,
+        request: Callable[[str], Awaitable[T]],
+        timeout: Optional[float],
+        started: list,
+    ) -> T:
+        timeout = self.timeout_for(provider, model, timeout)
+        slots = self.slots(provider)
+        with tracer.span("provider.request", provider=provider, model=model, timeout=timeout) as span:
+            if slots is None:
+                return await self._run(provider, request, timeout)
+
+            launched = started[1]
+            async with slots:
+                # waiting for a slot counts neither towards the timeout nor the latency
+                started[1] = asyncio.get_running_loop().time()
+                span.set(slot_wait=started[1] - launched)
+                return await self._run(provider, request, timeout)
+
+    @staticmethod
+    async def _run(provider: str, request: Callable[[str], Awaitable[T]], timeout: Optional[float]) -> T:
+        providers_in_flight.inc(provider)
+        try:
+            return await asyncio.wait_for(request(provider), timeout)
+        finally:
+            providers_in_flight.dec(provider)
+
+    def candidates(self, providers: Iterable[str], model: str) -> List[str]:
+        """Filters out providers with an open circuit, keeping the given order.
+
+        If every circuit is open the first provider is kept, so the user still
+        gets an answer or a real error.
+        """
+        providers = list(dict.fromkeys(providers))
+        healthy = [provider for provider in providers if self.available(provider, model)]
+        return healthy or providers[:1]
+
+    def hedge_delay(
+        self, provider: str, model: str, minimum: float, timeout: Optional[float] = None
+    ) -> float:
+        p95 = self.stats(provider, model).percentile(0.95)
+        if p95 is not None:
+            return max(minimum, p95)
+
+        # no history yet, the backup has to start well before the attempt times out
+        delay = self.hedge_cold_delay
+        timeout = self.timeout_for(provider, model, timeout)
+        if timeout is not None:
+            delay = min(delay, timeout / 2)
+        return max(minimum, delay)
+
+    async def call(
+        self,
+        providers: Iterable[str],
+        model: str,
+        request: Callable[[str], Awaitable[T]],
+        timeout: Optional[float] = None,
+        hedge: bool = False,
+        hedge_min_delay: float = 2.0,
+        can_retry: Optional[Callable[[], bool]] = None,
+    ) -> Tuple[str, T]:
+        """Runs ``request(provider)`` on the first healthy provider, failing over on errors.
+
+        :param providers: Provider names in order of preference.
+        :param timeout: Per-attempt deadline in seconds, unless ``timeouts`` has one.
+        :param hedge: Start a backup request on the next provider when the
+            current one is slower than its p95 latency, keeping the first answer.
+        :param can_retry: Checked after a failure; returning False stops failover,
+            e.g. once a streamed answer has been partially shown.
+        :return: The provider that answered and its result.
+        """
+        queue = deque(self.candidates(providers, model))
+        if not queue:
+            raise ValueError("No provider to call")
+
+        loop = asyncio.get_running_loop()
+        # task -> [provider, start time], the start moves once a slot is free
+        running: Dict[asyncio.Task, list] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch() -> None:
+            provider = queue.popleft()
+            self.acquire(provider, model)
+            started = [provider, loop.time()]
+            task = asyncio.create_task(self._attempt(provider, model, request, timeout, started))
+            running[task] = started
+
+        launch()
+        try:
+            while running:
+                wait = None
+                if hedge and queue:
+                    newest_provider, started = max(running.values(), key=lambda r: r[1])
+                    wait = max(
+                        0.0,
+                        started
+                        + self.hedge_delay(newest_provider, model, hedge_min_delay, timeout)
+                        - loop.time(),
+                    )
+
+                done, _ = await asyncio.wait(
+                    running, timeout=wait, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    logger.debug("Hedging %s request on %s", model, queue[0])
+                    launch()
+                    continue
+
+                for task in done:
+                    provider, started = running.pop(task)
+                    latency = loop.time() - started
+                    error = task.exception()
+
+                    if error is None:
+                        self.record_success(provider, model, latency)
+                        return provider, task.result()
+
+                    self.record_failure(provider, model, latency)
+                    logger.warning("%s failed for %s after %.1fs: %r", provider, model, latency, error)
+                    last_error = error
+
+                if not running and queue and (can_retry is None or can_retry()):
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise last_error
+
+
+provider_health = ProviderHealth(
+    open_seconds=settings.PROVIDER_CIRCUIT_OPEN_SECONDS,
+    max_in_flight=settings.PROVIDER_MAX_IN_FLIGHT,
+    timeouts=settings.PROVIDER_TIMEOUTS,
+    hedge_cold_delay=settings.PROVIDER_HEDGE_COLD_DELAY,
+)
@@ -0,0 +1,331 @@
+import asyncio
+import time
+from bisect import bisect_left
+from functools import wraps
+from logging import getLogger
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+from gpt_assistant.db.querycount import count_queries
+from gpt_assistant.tracing import tracer
+
+logger = getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Tuple[str, ...]
+
+
+def format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, *labels: str, value: float) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._values.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = []
+        names = self.labels + ("le",)
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{format_labels(names, labels + (format_value(bound),))} {cumulative}"
+                )
+            rendered = format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{rendered} {format_value(total)}")
+            lines.append(f"{self.name}_count{rendered} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Recording is a dict update and nothing else; values that other objects
+    already keep (cache and queue stats...) are read by collectors only when
+    the metrics are rendered.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]] = []
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def collector(self, func: Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]):
+        """Registers ``func`` yielding ``(name, labels, value)`` gauge samples at render time."""
+        self._collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            samples = metric.render()
+            if samples:
+                lines += metric.header() + samples
+
+        collected: Dict[str, List[str]] = {}
+        for func in self._collectors:
+            try:
+                for name, labels, value in func():
+                    collected.setdefault(name, []).append(
+                        f"{name}{format_labels(labels.keys(), labels.values())} {format_value(value)}"
+                    )
+            except Exception:
+                logger.exception("Metrics collector %s failed", func.__name__)
+
+        for name, samples in collected.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines += samples
+
+        return "\n".join(lines) + "\n"
+
+
+def stats_collector(prefix: str, label: str, sources: Dict[str, object]):
+    """Builds a collector exposing the numeric ``stats()`` of every source as
+    ``<prefix>_<key>{<label>="<source name>"}``."""
+
+    def collect():
+        for name, source in sources.items():
+            for key, value in source.stats().items():
+                if isinstance(value, (int, float)):
+                    yield f"{prefix}_{key}", {label: name}, value
+
+    collect.__name__ = f"collect_{prefix}"
+    return collect
+
+
+async def serve(registry: MetricsRegistry, host: str, port: int) -> None:
+    """Serves ``registry`` at ``http://host:port/metrics`` until cancelled."""
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+metrics = MetricsRegistry()
+
+handler_latency = metrics.histogram(
+    "bot_handler_seconds", "Time spent in update handlers.", ("handler", "outcome")
+)
+handlers_in_flight = metrics.gauge(
+    "bot_handlers_in_flight", "Update handlers currently running.", ("handler",)
+)
+query_latency = metrics.histogram(
+    "bot_crud_seconds", "Time spent in CRUD functions.", ("function", "outcome")
+)
+provider_latency = metrics.histogram(
+    "bot_provider_seconds", "Provider request latency.", ("provider", "model", "outcome")
+)
+providers_in_flight = metrics.gauge(
+    "bot_provider_in_flight", "Provider requests currently running.", ("provider",)
+)
+telegram_latency = metrics.histogram(
+    "bot_telegram_seconds", "Bot API request latency.", ("method", "outcome")
+)
+
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+handler_statements = metrics.histogram(
+    "bot_handler_db_statements", "SQL statements per handled update.", ("handler",), QUERY_BUCKETS
+)
+handler_round_trips = metrics.histogram(
+    "bot_handler_db_round_trips", "Database round trips per handled update.", ("handler",), QUERY_BUCKETS
+)
+
+
+def instrument(histogram: Histogram, name: str, in_flight: Optional[Gauge] = None):
+    """Records the duration and outcome of every call of the decorated coroutine
+    function in ``histogram``, labelled with ``name``."""
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if in_flight is not None:
+                in_flight.inc(name)
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                histogram.observe(name, outcome, value=time.perf_counter() - started)
+                if in_flight is not None:
+                    in_flight.dec(name)
+
+        return wrapper
+
+    return decorator
+
+
+def traced(name: str):
+    """Runs every call of the decorated coroutine function in a span named ``name``."""
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count_handler_queries(name: str):
+    """Records the statements and round trips of every call of the decorated
+    handler, on its span as well when it is traced."""
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with count_queries() as count:
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    handler_statements.observe(name, value=count.statements)
+                    handler_round_trips.observe(name, value=count.round_trips)
+                    tracer.current().set(db_statements=count.statements, db_round_trips=count.round_trips)
+
+        return wrapper
+
+    return decorator
+
+
+def track_handler(name: str):
+    def decorator(func):
+        func = count_handler_queries(name)(func)
+        return traced(f"handler.{name}")(instrument(handler_latency, name, handlers_in_flight)(func))
+
+    return decorator
+
+
+def track_crud(func):
+    return traced(f"crud.{func.__name__}")(instrument(query_latency, func.__name__)(func))
+
+
+async def track_telegram(method: str, call):
+    """Awaits the Bot API request ``call`` and records it under ``method``."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await call
+        outcome = "ok"
+        return result
+    finally:
+        telegram_latency.observe(method, outcome, value=time.perf_counter() - started)
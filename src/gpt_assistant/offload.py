@@ -0,0 +1,80 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from logging import getLogger
+from typing import Callable, Optional, TypeVar
+
+from gpt_assistant import settings
+
+logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+_executor: Optional[Executor] = None
+
+
+def get_executor() -> Executor:
+    global _executor
+
+    if _executor is None:
+        if settings.CPU_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=settings.CPU_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CPU_WORKERS, thread_name_prefix="cpu"
+            )
+        logger.debug("Started %s CPU executor", settings.CPU_EXECUTOR)
+
+    return _executor
+
+
+async def run_cpu(func: Callable[..., T], *args, **kwargs) -> T:
+    """Runs CPU-bound ``func`` in the shared executor instead of on the event loop.
+
+    With ``CPU_EXECUTOR=process`` the function and its arguments must be picklable.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args, **kwargs))
+
+
+def shutdown() -> None:
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a periodic sleep.
+
+    A lag above ``threshold`` seconds means something blocked the loop and is
+    logged as a warning.
+    """
+
+    def __init__(self, interval: float = 0.5, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    async def run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+
+            if lag > self.threshold:
+                self.stalls += 1
+                logger.warning("Event loop was blocked for %.3fs", lag)
+
+
+loop_monitor = LoopLagMonitor(
+    interval=settings.LOOP_LAG_INTERVAL, threshold=settings.LOOP_LAG_THRESHOLD
+)
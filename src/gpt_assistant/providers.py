@@ -0,0 +1,107 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Dict, List, NamedTuple, Optional
+
+from g4f import Provider
+
+logger = getLogger(__name__)
+
+
+class ProviderInfo(NamedTuple):
+    name: str
+    cls: type
+    models: List[str]
+    image_models: List[str]
+    default_model: Optional[str]
+    default_image_model: Optional[str]
+
+
+def is_eligible(provider: type) -> bool:
+    """Free providers that accept a system message and a conversation history."""
+    return bool(
+        getattr(provider, "supports_system_message", False)
+        and getattr(provider, "supports_message_history", False)
+        and hasattr(provider, "needs_auth")
+        and not provider.needs_auth
+        and getattr(provider, "default_model", None)
+    )
+
+
+def describe(provider: type) -> ProviderInfo:
+    """Collects the models of ``provider``, which may hit the network."""
+    models = getattr(provider, "models", None) or []
+
+    if hasattr(provider, "get_models"):
+        try:
+            models = provider.get_models() or models
+        except Exception as err:
+            logger.warning("Could not fetch models of %s: %s", provider.__name__, err)
+
+    return ProviderInfo(
+        name=provider.__name__,
+        cls=provider,
+        models=[str(model) for model in models],
+        image_models=[str(model) for model in getattr(provider, "image_models", None) or []],
+        default_model=provider.default_model,
+        default_image_model=getattr(provider, "default_image_model", None),
+    )
+
+
+class ProviderRegistry:
+    """Index of eligible g4f providers and their models, rebuilt off the event loop."""
+
+    def __init__(self, workers: int = 8):
+        self.workers = workers
+        self.version = 0
+        self.built_at: Optional[float] = None
+        self._providers: Dict[str, ProviderInfo] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._providers
+
+    def get(self, name: str) -> Optional[ProviderInfo]:
+        return self._providers.get(name)
+
+    def providers(self) -> List[ProviderInfo]:
+        return list(self._providers.values())
+
+    def providers_for_model(self, model: str) -> List[ProviderInfo]:
+        return [info for info in self._providers.values() if model in info.models]
+
+    def providers_for_image_model(self, model: str) -> List[ProviderInfo]:
+        return [info for info in self._providers.values() if model in info.image_models]
+
+    def build(self, candidates: Optional[List[type]] = None) -> None:
+        """:param candidates: Providers to index instead of every g4f provider."""
+        if candidates is None:
+            candidates = [
+                getattr(Provider, name)
+                for name in dir(Provider)
+                if isinstance(getattr(Provider, name), type) and name != "Local"
+            ]
+        eligible = [provider for provider in candidates if is_eligible(provider)]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            infos = list(executor.map(describe, eligible))
+
+        # swap the whole index at once so readers never see a partial build
+        self._providers = {info.name: info for info in infos}
+        self.version += 1
+        self.built_at = time.time()
+        logger.info("Provider registry built with %d providers", len(infos))
+
+    async def refresh(self) -> None:
+        await asyncio.to_thread(self.build)
+
+    async def refresh_forever(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Provider registry refresh failed")
+
+
+provider_registry = ProviderRegistry()
@@ -0,0 +1,111 @@
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import Dict, Hashable, Optional
+
+logger = getLogger(__name__)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float, amount: float = 1.0) -> float:
+        """Seconds until ``amount`` tokens are available, 0 if they already are."""
+        self.refill(now)
+        missing = amount - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def full_at(self) -> float:
+        return self.updated + (self.capacity - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Keyed token buckets with bounded memory.
+
+    Each key gets a bucket refilling at ``rate`` tokens per second up to
+    ``burst``. Buckets that have refilled completely carry no state and are
+    evicted lazily, and at most ``max_entries`` buckets are kept (least
+    recently used first out), so memory stays flat however many keys are seen.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0, max_entries: int = 100_000):
+        """
+        :param rate: Tokens added per second.
+        :param burst: Bucket capacity, i.e. how many requests may pass back to back.
+        :param max_entries: Maximum number of tracked keys.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_entries = max_entries
+
+        self.allowed = 0
+        self.delayed = 0
+        self.rejected = 0
+
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: Hashable, max_wait: float = 0.0) -> Optional[float]:
+        """Takes a token for ``key``.
+
+        :param max_wait: Longest acceptable wait. Within it, the token is
+            reserved ahead of time and the wait is returned to the caller.
+        :return: Seconds the caller has to wait before proceeding (0 when
+            allowed right away), or ``None`` if the request must be dropped.
+        """
+        now = time.monotonic()
+        self._evict(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        delay = bucket.delay(now)
+
+        if delay == 0:
+            bucket.tokens -= 1
+            self.allowed += 1
+            return 0.0
+
+        if delay <= max_wait:
+            # reserve the token now, so later requests queue up behind this one
+            bucket.tokens -= 1
+            self.delayed += 1
+            return delay
+
+        self.rejected += 1
+        return None
+
+    def _evict(self, now: float, batch: int = 8) -> None:
+        # the front of the LRU order holds the longest idle buckets
+        for _ in range(batch):
+            if not self._buckets:
+                break
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket.full_at() > now:
+                break
+            del self._buckets[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "delayed": self.delayed,
+            "rejected": self.rejected,
+        }
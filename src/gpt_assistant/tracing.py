@@ -0,0 +1,192 @@
+import atexit
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import INFO, Formatter, Logger
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+from typing import Any, Dict, Iterator, List, Optional
+
+from gpt_assistant import settings
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List["Span"] = []
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start", "start_ns", "end_ns", "status")
+
+    def __init__(self, trace: Trace, parent_id: Optional[str], name: str, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "ok"
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9 if self.end_ns else time.perf_counter() - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        # field names follow the OTLP JSON span encoding
+        return {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round(self.duration * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class NoopSpan:
+    """Stands in for a span when the update isn't traced."""
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer:
+    """Per-update spans kept in memory and exported as JSON lines when the trace ends.
+
+    A trace is written if it was sampled (``sample_rate``) or took at least
+    ``slow_threshold`` seconds, so slow updates are always kept. The file is
+    rotated and written by a background thread. With neither option set,
+    spans are no-ops.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        slow_threshold: Optional[float] = None,
+        path: str = "logs/traces.jsonl",
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 3,
+    ):
+        """
+        :param sample_rate: Fraction of traces written regardless of their duration.
+        :param slow_threshold: Traces at least this many seconds long are always written.
+        :param path: JSONL file the spans are written to.
+        :param max_bytes: Size of the file before it is rotated.
+        :param backup_count: Number of rotated files to keep.
+        """
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self.exported = 0
+        self._exporter: Optional[Logger] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_threshold is not None
+
+    @staticmethod
+    def current() -> Any:
+        return _current_span.get() or NOOP_SPAN
+
+    @contextmanager
+    def trace(self, name: str, **attributes) -> Iterator[Any]:
+        """Opens the root span of a new trace."""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+
+        trace = Trace()
+        try:
+            with self._span(trace, None, name, attributes) as span:
+                yield span
+        finally:
+            if random.random() < self.sample_rate or (
+                self.slow_threshold is not None and span.duration >= self.slow_threshold
+            ):
+                self._export(trace)
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attributes) -> Iterator[Any]:
+        """Opens a child of ``parent``, by default of the current span.
+
+        Outside of a trace this is a no-op.
+        """
+        parent = parent or _current_span.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+
+        with self._span(parent.trace, parent.span_id, name, attributes) as span:
+            yield span
+
+    @contextmanager
+    def _span(self, trace: Trace, parent_id: Optional[str], name: str, attributes: Dict[str, Any]) -> Iterator[Span]:
+        span = Span(trace, parent_id, name, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as err:
+            span.status = "error"
+            span.attributes["error"] = repr(err)
+            raise
+        finally:
+            span.end_ns = span.start_ns + int((time.perf_counter() - span.start) * 1e9)
+            trace.spans.append(span)
+            _current_span.reset(token)
+
+    def _export(self, trace: Trace) -> None:
+        if self._exporter is None:
+            self._exporter = self._open_exporter()
+
+        for span in trace.spans:
+            self._exporter.info(json.dumps(span.to_dict(), default=str, ensure_ascii=False))
+        self.exported += 1
+
+    def _open_exporter(self) -> Logger:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backup_count)
+        handler.setFormatter(Formatter("%(message)s"))
+
+        queue: SimpleQueue = SimpleQueue()
+        listener = QueueListener(queue, handler)
+        listener.start()
+        atexit.register(listener.stop)
+
+        # a standalone logger, so the spans don't end up in the regular logs
+        exporter = Logger("traces", INFO)
+        exporter.addHandler(QueueHandler(queue))
+        return exporter
+
+
+tracer = Tracer(
+    sample_rate=settings.TRACE_SAMPLE_RATE,
+    slow_threshold=settings.TRACE_SLOW_THRESHOLD,
+    path=settings.TRACE_FILE,
+    max_bytes=settings.TRACE_MAX_BYTES,
+    backup_count=settings.TRACE_BACKUP_COUNT,
+)
@@ -0,0 +1,91 @@
+from io import BytesIO
+from logging import getLogger
+
+from PIL import Image, ImageOps
+from telebot.async_telebot import AsyncTeleBot
+
+from gpt_assistant import settings
+from gpt_assistant._defaults import (DEFAULT_IMAGE_MAX_DIMENSION,
+                                     IMAGE_MAX_DIMENSIONS)
+from gpt_assistant.cache import FileCache, LRUCache
+from gpt_assistant.metrics import track_telegram
+from gpt_assistant.offload import run_cpu
+from gpt_assistant.tracing import tracer
+
+logger = getLogger(__name__)
+
+# Telegram keeps download links valid for at least an hour.
+file_paths = LRUCache(maxsize=10_000, ttl=55 * 60)
+
+image_cache = FileCache(
+    max_bytes=settings.IMAGE_CACHE_BYTES,
+    directory=settings.IMAGE_CACHE_DIR or None,
+    max_disk_bytes=settings.IMAGE_CACHE_DISK_BYTES,
+)
+
+
+async def download_file(bot: AsyncTeleBot, file_id: str) -> bytes:
+    """Downloads a Telegram file, serving repeated requests from ``image_cache``."""
+    with tracer.span("image.download", file_id=file_id) as span:
+        data = await image_cache.get(file_id)
+        if data is not None:
+            span.set(cached=True)
+            return data
+
+        file_path = file_paths.get(file_id)
+        if file_path is None:
+            file = await track_telegram("get_file", bot.get_file(file_id))
+            file_path = file.file_path
+            file_paths.set(file_id, file_path)
+
+        data = await track_telegram("download_file", bot.download_file(file_path))
+        await image_cache.set(file_id, data)
+        span.set(cached=False, bytes=len(data))
+
+    logger.debug("Downloaded %s (%d bytes)", file_id, len(data))
+    return data
+
+
+def preprocess_image(data: bytes, max_dimension: int, image_format: str, quality: int) -> bytes:
+    """Applies EXIF orientation, downsizes to ``max_dimension`` and re-encodes.
+
+    CPU-bound, meant to run through ``offload.run_cpu``.
+    """
+    image = Image.open(BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+
+    if max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    output = BytesIO()
+    image.save(output, format=image_format, quality=quality)
+    return output.getvalue()
+
+
+async def prepare_image(bot: AsyncTeleBot, file_id: str, model: str) -> bytes:
+    """Returns the image behind ``file_id`` preprocessed for ``model``, cached by both."""
+    max_dimension = IMAGE_MAX_DIMENSIONS.get(model.lower(), DEFAULT_IMAGE_MAX_DIMENSION)
+    key = f"{file_id}:{max_dimension}:{settings.IMAGE_FORMAT}:{settings.IMAGE_QUALITY}"
+
+    with tracer.span("image.prepare", file_id=file_id, model=model) as span:
+        data = await image_cache.get(key)
+        if data is not None:
+            span.set(cached=True)
+            return data
+
+        original = await download_file(bot, file_id)
+        data = await run_cpu(
+            preprocess_image,
+            original,
+            max_dimension,
+            settings.IMAGE_FORMAT,
+            settings.IMAGE_QUALITY,
+        )
+        await image_cache.set(key, data)
+        span.set(cached=False, bytes=len(data))
+
+    logger.debug("Preprocessed %s for %s: %d -> %d bytes", file_id, model, len(original), len(data))
+    return data
@@ -0,0 +1,263 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from logging import getLogger
+from typing import Any, Deque, Dict, Hashable, List, Optional, Tuple
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import Message as TelebotMessage
+
+from gpt_assistant.metrics import track_telegram
+from gpt_assistant.ratelimit import TokenBucket
+from gpt_assistant.tracing import tracer
+
+logger = getLogger(__name__)
+
+
+class OutboundJob:
+    __slots__ = ("method", "args", "kwargs", "coalesce_key", "future", "retries")
+
+    def __init__(self, method: str, args: tuple, kwargs: dict, coalesce_key: Optional[Hashable]):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.retries = 0
+
+
+class ChatQueue:
+    __slots__ = ("jobs", "bucket", "worker", "paused_until")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.jobs: Deque[OutboundJob] = deque()
+        self.bucket = TokenBucket(rate, burst, now)
+        self.worker: Optional[asyncio.Task] = None
+        self.paused_until = 0.0
+
+
+class OutboundScheduler:
+    """Sends Telegram requests within the Bot API flood limits.
+
+    Requests of one chat go out in order through a per-chat queue, paced by a
+    per-chat token bucket, while a shared bucket keeps the whole bot under
+    ``rate`` requests per second. A ``429 Too Many Requests`` pauses the chat
+    for the advertised ``retry_after`` and the request is retried. An edit of
+    a message whose previous edit is still the last request waiting in the
+    chat is merged into it, so only the latest text is sent.
+
+    The send methods mirror their ``AsyncTeleBot`` counterparts and resolve to
+    the same results once the request has actually been made.
+    """
+
+    def __init__(
+        self,
+        bot: AsyncTeleBot,
+        rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+        max_chats: int = 100_000,
+    ):
+        """
+        :param bot: Bot the requests are made with.
+        :param rate: Requests per second over all chats.
+        :param chat_rate: Requests per second within a single chat.
+        :param chat_burst: Requests a chat may send back to back after being idle.
+        :param max_retries: Retries of a request answered with 429.
+        :param max_chats: Maximum number of idle chat queues kept for pacing.
+        """
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+
+        self.sent = 0
+        self.coalesced = 0
+        self.throttled = 0
+
+        self._global = TokenBucket(rate, rate, time.monotonic())
+        self._chats: "OrderedDict[int, ChatQueue]" = OrderedDict()
+
+    async def reply_to(self, message: TelebotMessage, text: str, **kwargs) -> TelebotMessage:
+        return await self.submit(message.chat.id, "reply_to", message, text, **kwargs)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> TelebotMessage:
+        return await self.submit(chat_id, "send_message", chat_id, text, **kwargs)
+
+    async def send_media_group(self, chat_id: int, media: list, **kwargs) -> List[TelebotMessage]:
+        return await self.submit(chat_id, "send_media_group", chat_id, media, **kwargs)
+
+    async def edit_message_text(
+        self, text: str, chat_id: int, message_id: int, **kwargs
+    ) -> Any:
+        return await self.submit(
+            chat_id,
+            "edit_message_text",
+            text,
+            chat_id,
+            message_id,
+            coalesce_key=("edit_message_text", message_id),
+            **kwargs,
+        )
+
+    async def delete_message(self, chat_id: int, message_id: int, **kwargs) -> bool:
+        return await self.submit(chat_id, "delete_message", chat_id, message_id, **kwargs)
+
+    async def send_chat_action(self, chat_id: int, action: str, **kwargs) -> bool:
+        # status updates don't show up in the chat, they only count against the global limit
+        with tracer.span("telegram.send_chat_action", chat_id=chat_id):
+            await self._take_global()
+            return await track_telegram(
+                "send_chat_action", self.bot.send_chat_action(chat_id, action, **kwargs)
+            )
+
+    async def answer_callback_query(self, callback_query_id: str, *args, **kwargs) -> bool:
+        with tracer.span("telegram.answer_callback_query"):
+            await self._take_global()
+            return await track_telegram(
+                "answer_callback_query",
+                self.bot.answer_callback_query(callback_query_id, *args, **kwargs),
+            )
+
+    async def submit(
+        self,
+        chat_id: int,
+        method: str,
+        *args,
+        coalesce_key: Optional[Hashable] = None,
+        **kwargs,
+    ) -> Any:
+        """Queues ``bot.<method>(*args, **kwargs)`` in the queue of ``chat_id``.
+
+        :param coalesce_key: A request replaces the last waiting one of the chat
+            if both have this key, instead of queueing behind it; both callers
+            get the newest result.
+        """
+        with tracer.span(f"telegram.{method}", chat_id=chat_id) as span:
+            job, coalesced = self._enqueue(chat_id, method, args, kwargs, coalesce_key)
+            span.set(coalesced=coalesced)
+            return await asyncio.shield(job.future)
+
+    def _enqueue(
+        self,
+        chat_id: int,
+        method: str,
+        args: tuple,
+        kwargs: dict,
+        coalesce_key: Optional[Hashable],
+    ) -> Tuple[OutboundJob, bool]:
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            self._evict()
+            queue = self._chats[chat_id] = ChatQueue(self.chat_rate, self.chat_burst, time.monotonic())
+        else:
+            self._chats.move_to_end(chat_id)
+
+        # only the last job may be replaced, merging into an earlier one would
+        # send the new text before whatever was queued after it
+        if coalesce_key is not None and queue.jobs and queue.jobs[-1].coalesce_key == coalesce_key:
+            job = queue.jobs[-1]
+            job.args = args
+            job.kwargs = kwargs
+            self.coalesced += 1
+            return job, True
+
+        job = OutboundJob(method, args, kwargs, coalesce_key)
+        queue.jobs.append(job)
+
+        if queue.worker is None:
+            queue.worker = asyncio.create_task(self._drain(chat_id, queue))
+
+        return job, False
+
+    async def _drain(self, chat_id: int, queue: ChatQueue) -> None:
+        try:
+            while queue.jobs:
+                job = queue.jobs[0]
+
+                now = time.monotonic()
+                wait = max(queue.paused_until - now, queue.bucket.delay(now))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                queue.bucket.tokens -= 1
+                await self._take_global()
+
+                # taken off the queue only now, so edits keep merging into it while it waits
+                queue.jobs.popleft()
+
+                try:
+                    result = await track_telegram(
+                        job.method, getattr(self.bot, job.method)(*job.args, **job.kwargs)
+                    )
+                except ApiTelegramException as err:
+                    retry_after = self._retry_after(err)
+                    if retry_after is None or job.retries >= self.max_retries:
+                        if not job.future.done():
+                            job.future.set_exception(err)
+                        continue
+
+                    job.retries += 1
+                    self.throttled += 1
+                    queue.paused_until = time.monotonic() + retry_after
+                    queue.jobs.appendleft(job)
+                    logger.warning("Flood limit hit in %d, retrying in %ss", chat_id, retry_after)
+                except Exception as err:
+                    if not job.future.done():
+                        job.future.set_exception(err)
+                else:
+                    self.sent += 1
+                    if not job.future.done():
+                        job.future.set_result(result)
+        finally:
+            queue.worker = None
+
+    async def _take_global(self) -> None:
+        delay = self._global.delay(time.monotonic())
+        # reserve the token before sleeping, so concurrent callers line up behind it
+        self._global.tokens -= 1
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retry_after(err: ApiTelegramException) -> Optional[float]:
+        if err.error_code != 429:
+            return None
+        parameters = (err.result_json or {}).get("parameters") or {}
+        return float(parameters.get("retry_after", 1))
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while len(self._chats) >= self.max_chats:
+            chat_id, queue = next(iter(self._chats.items()))
+            if queue.worker is not None or queue.jobs:
+                break
+            del self._chats[chat_id]
+
+        # idle queues whose bucket has refilled carry no pacing state
+        for _ in range(8):
+            if not self._chats:
+                break
+            chat_id, queue = next(iter(self._chats.items()))
+            if queue.worker is not None or queue.jobs or queue.bucket.full_at() > now:
+                break
+            del self._chats[chat_id]
+
+    async def join(self, timeout: Optional[float] = None) -> None:
+        """Waits until every queued request has been sent."""
+        workers = [queue.worker for queue in self._chats.values() if queue.worker is not None]
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chats": len(self._chats),
+            "queued": sum(len(queue.jobs) for queue in self._chats.values()),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "throttled": self.throttled,
+        }
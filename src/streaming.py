@@ -0,0 +1,176 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Callable, List, Optional, Union
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import Message as TelebotMessage
+
+from outbound import OutboundScheduler
+from utils import split_text
+
+logger = getLogger(__name__)
+
+
+class StreamingReply:
+    """Renders a streamed completion as one or more progressively edited replies.
+
+    Text is accumulated with :meth:`feed`. The first visible text is sent right
+    away, later edits are coalesced to at most one per ``edit_interval``
+    seconds, and text beyond ``max_length`` rolls over to a new reply. Text
+    held back by the interval is flushed once it has passed, even if no more
+    chunks arrive. A stream that ends without :meth:`finish` (an error, a
+    cancellation) has to be closed with :meth:`close`, which stops them.
+    """
+
+    def __init__(
+        self,
+        bot: Union[AsyncTeleBot, OutboundScheduler],
+        message: TelebotMessage,
+        max_length: int = 4096,
+        edit_interval: float = 1.5,
+        transform: Optional[Callable[[str, bool], str]] = None,
+    ):
+        """
+        :param bot: Bot, or the outbound scheduler, used to send and edit the replies.
+        :param message: Message being replied to.
+        :param max_length: Maximum length of a single Telegram message.
+        :param edit_interval: Minimum seconds between two edits.
+        :param transform: Called with every delta, and ``final`` once the stream
+            ends, returns the part of it to show, e.g. :class:`utils.ThinkFilter`.
+        """
+        self.bot = bot
+        self.message = message
+        self.max_length = max_length
+        self.edit_interval = edit_interval
+        self.transform = transform
+
+        self.text = ""
+        self._visible = ""
+        self.replies: List[TelebotMessage] = []
+        self._shown: List[str] = []
+        self._last_render = 0.0
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._finished = False
+
+    @property
+    def visible_text(self) -> str:
+        return self._visible
+
+    async def feed(self, delta: str) -> None:
+        if not delta:
+            return
+
+        self.text += delta
+        self._visible += self.transform(delta, False) if self.transform else delta
+
+        wait = self._last_render + self.edit_interval - time.monotonic()
+        if self.replies and wait > 0:
+            if self._flusher is None:
+                self._flusher = asyncio.create_task(self._flush_later(wait))
+            return
+
+        async with self._lock:
+            await self._render(final=False)
+
+    async def finish(self) -> str:
+        """Flushes the remaining text with the bot's parse mode and returns it."""
+        self._cancel_flusher()
+        self._finished = True
+        if self.transform:
+            self._visible += self.transform("", True)
+
+        async with self._lock:
+            await self._render(final=True)
+        return self.visible_text
+
+    async def close(self) -> None:
+        """Ends a stream cut short, giving what was shown so far its final rendering.
+
+        Does nothing after :meth:`finish`, so it can go in a ``finally``.
+        """
+        self._cancel_flusher()
+        if self._finished or not self.replies:
+            return
+        self._finished = True
+
+        try:
+            async with self._lock:
+                await self._render(final=True)
+        except Exception as err:
+            logger.debug("Could not close streamed reply in %d: %s", self.message.chat.id, err)
+
+    def _cancel_flusher(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._flusher = None
+        try:
+            async with self._lock:
+                await self._render(final=False)
+        except Exception as err:
+            logger.debug("Could not flush streamed reply in %d: %s", self.message.chat.id, err)
+
+    async def _render(self, final: bool) -> None:
+        text = self.visible_text.strip()
+        if not text:
+            return
+
+        # Partial markdown is usually unbalanced, so only the final pass is parsed.
+        parse_mode = None if final else ""
+        chunks = split_text(text, self.max_length)
+
+        for index, chunk in enumerate(chunks):
+            if index < len(self.replies):
+                if self._shown[index] == chunk and not final:
+                    continue
+                await self._edit(index, chunk, parse_mode)
+            else:
+                reply = await self._send(chunk, parse_mode)
+                self.replies.append(reply)
+                self._shown.append(chunk)
+
+        if final:
+            # the formatted text may fit in fewer replies than the raw one did
+            while len(self.replies) > len(chunks):
+                await self._delete(self.replies.pop())
+                self._shown.pop()
+
+        self._last_render = time.monotonic()
+
+    async def _send(self, text: str, parse_mode: Optional[str]) -> TelebotMessage:
+        try:
+            return await self.bot.reply_to(self.message, text, parse_mode=parse_mode)
+        except ApiTelegramException:
+            if parse_mode == "":
+                raise
+            logger.debug("Could not parse reply in %d, sending it as plain text", self.message.chat.id)
+            return await self.bot.reply_to(self.message, text, parse_mode="")
+
+    async def _delete(self, reply: TelebotMessage) -> None:
+        try:
+            await self.bot.delete_message(reply.chat.id, reply.id)
+        except ApiTelegramException as err:
+            # too old to delete, blank it out instead
+            logger.debug("Could not delete streamed reply %d: %s", reply.id, err)
+            try:
+                await self.bot.edit_message_text("…", reply.chat.id, reply.id, parse_mode="")
+            except ApiTelegramException:
+                pass
+
+    async def _edit(self, index: int, text: str, parse_mode: Optional[str]) -> None:
+        reply = self.replies[index]
+
+        try:
+            await self.bot.edit_message_text(text, reply.chat.id, reply.id, parse_mode=parse_mode)
+        except ApiTelegramException as err:
+            # "message is not modified" and unparsable markdown both leave
+            # the previous (plain) rendering in place, which is good enough.
+            logger.debug("Could not edit streamed reply %d: %s", reply.id, err)
+
+        self._shown[index] = text
@@ -25,6 +25,11 @@ def format_messages(messages: List[Message], instruction: str) -> List[Dict[str,
     return list(reversed(final_messages))
 
 
+def estimate_tokens(text: str | None) -> int:
+    # ~4 characters per token for English text, good enough for budgeting
+    return (len(text) + 3) // 4 if text else 0
+
+
 def extract_text(message_text: str) -> str | None:
     if not message_text:
         return None
@@ -34,8 +39,61 @@ def extract_text(message_text: str) -> str | None:
     return text if text else None
 
 
-def no_need_to_think(text: str) -> str:
-    return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+def no_need_to_think(text: str, partial: bool = False) -> str:
+    # a partial (still streaming) answer may end inside an unclosed <think> block
+    pattern = r"<think>.*?(?:</think>|\Z)" if partial else r"<think>.*?</think>"
+    return re.sub(pattern, "", text, flags=re.DOTALL)
+
+
+class ThinkFilter:
+    """Streaming counterpart of ``no_need_to_think(text, partial=True)``.
+
+    Called with each delta, returns the part of it outside ``<think>`` blocks,
+    so the work per delta doesn't grow with the length of the answer. A tag
+    split across deltas is held back until the next one, and released by the
+    ``final`` call if it didn't turn out to be a tag.
+    """
+
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self.thinking = False
+        self._held = ""
+
+    def __call__(self, delta: str, final: bool = False) -> str:
+        text = self._held + delta
+        self._held = ""
+        visible = []
+
+        while text:
+            tag = self.CLOSE if self.thinking else self.OPEN
+            index = text.find(tag)
+            if index == -1:
+                held = 0 if final else self._tag_prefix(text, tag)
+                if not self.thinking:
+                    visible.append(text[: len(text) - held])
+                self._held = text[len(text) - held :]
+                break
+
+            if not self.thinking:
+                visible.append(text[:index])
+            text = text[index + len(tag) :]
+            self.thinking = not self.thinking
+
+        return "".join(visible)
+
+    @staticmethod
+    def _tag_prefix(text: str, tag: str) -> int:
+        """Length of the longest end of ``text`` that starts ``tag``."""
+        for length in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:length]):
+                return length
+        return 0
+
+
+def split_text(text, max_length):
+    return [text[i : i + max_length] for i in range(0, len(text), max_length)]
 
 def generate_config_message(config: Config):
     return (
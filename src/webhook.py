@@ -0,0 +1,80 @@
+import asyncio
+import hmac
+from logging import getLogger
+from typing import Optional
+
+from aiohttp import web
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+
+logger = getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def create_app(bot: AsyncTeleBot, path: str = "/webhook", secret: Optional[str] = None) -> web.Application:
+    """Builds an aiohttp app feeding Telegram updates POSTed to ``path`` into ``bot``.
+
+    Updates are acknowledged as soon as they are parsed and handled in the
+    background, the same way ``bot.polling`` does. Requests must carry
+    ``secret`` in the secret token header; without a secret every request is
+    refused, since a forged update could pose as one of the owners.
+    """
+    tasks = set()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not secret or not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            logger.warning("Rejected webhook request from %s: bad secret token", request.remote)
+            return web.Response(status=403)
+
+        try:
+            payload = await request.json()
+            update = Update.de_json(payload)
+        except Exception:
+            logger.warning("Rejected malformed webhook request from %s", request.remote)
+            return web.Response(status=400)
+
+        task = asyncio.create_task(bot.process_new_updates([update]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def run_webhook(
+    bot: AsyncTeleBot,
+    host: str,
+    port: int,
+    path: str = "/webhook",
+    url: Optional[str] = None,
+    secret: Optional[str] = None,
+) -> None:
+    """Serves the webhook until cancelled.
+
+    :param url: Public base URL registered with Telegram. Leave it unset when the
+        webhook is registered elsewhere, e.g. by another instance behind the same
+        load balancer, or when POSTing recorded updates locally.
+    :param secret: Secret token Telegram sends with every update, required.
+    """
+    if not secret:
+        raise ValueError("A webhook secret is required, updates could be forged without one")
+
+    runner = web.AppRunner(create_app(bot, path, secret))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Listening for webhook updates on %s:%d%s", host, port, path)
+
+    if url:
+        await bot.set_webhook(url=url.rstrip("/") + path, secret_token=secret)
+        logger.info("Webhook registered at %s%s", url.rstrip("/"), path)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.close_session()
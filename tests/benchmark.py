@@ -0,0 +1,605 @@
+"""Offline benchmark of the bot's handlers.
+
+Synthetic updates (``/ask`` with and without a photo, ``/imagine``, config
+buttons, ``/clear_history``...) are replayed through the real handlers of
+``src/__main__.py``, which talk to :class:`tests.fake_telegram.FakeTelegram`
+instead of the Bot API and to :class:`tests.fake_provider.FakeProvider`
+instead of g4f. The workload is seeded, so two runs of the same commit send
+the same updates.
+
+Runs on a throwaway SQLite file by default, or on any database given with
+``--database-url`` (e.g. a local Postgres; pass ``--reset`` to start from
+empty tables)::
+
+    python -m tests.benchmark --updates 2000 --users 200 --latency 0.05
+    python -m tests.benchmark --database-url postgresql+asyncpg://bot@localhost/bench --reset
+
+The bot reads its settings once, at import, so a process can only load it
+for one database.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, Iterator, List, Optional
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+MODULE_NAME = "smart_donkey_bot"
+
+# update kind -> share of the workload
+DEFAULT_MIX = {
+    "start": 0.05,
+    "ask": 0.40,
+    "ask_photo": 0.10,
+    "imagine": 0.10,
+    "config": 0.05,
+    "config_callback": 0.15,
+    "clear_history": 0.10,
+    "clear_history_confirm": 0.05,
+}
+
+CONFIG_BUTTONS = ("conf_streaming", "conf_cache", "conf_provider", "conf_lm")
+
+
+def load_bot(database_url: Optional[str] = None, workdir: Optional[str] = None) -> ModuleType:
+    """Imports ``src/__main__.py`` without starting it, configured for benchmarking.
+
+    Settings go through the environment, so this has to run before anything
+    imports ``gpt_assistant``.
+    """
+    if MODULE_NAME in sys.modules:
+        return sys.modules[MODULE_NAME]
+
+    workdir = workdir or tempfile.mkdtemp(prefix="smart-donkey-bench-")
+    os.environ.update(
+        TOKEN="123456:BENCHMARK",
+        DATABASE_URL=database_url or f"sqlite+aiosqlite:///{workdir}/bench.db",
+        OWNERS="[1]",
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+        LOG_DIR=os.path.join(workdir, "logs"),
+        TRACE_FILE=os.path.join(workdir, "traces.jsonl"),
+        # an empty value keeps the image cache in memory only
+        IMAGE_CACHE_DIR="",
+    )
+    os.environ.pop("METRICS_PORT", None)
+
+    if str(SRC) not in sys.path:
+        sys.path.insert(0, str(SRC))
+
+    # loaded under another name, "__main__" is taken by whoever runs us
+    spec = importlib.util.spec_from_file_location(MODULE_NAME, SRC / "__main__.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[MODULE_NAME] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of ``values``, ``q`` between 0 and 100."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+class Workload:
+    """Seeded stream of raw updates spread over ``users`` users and ``groups`` group chats.
+
+    Every user has a private chat with the bot and is a member of one group.
+    """
+
+    def __init__(self, users: int, groups: int = 0, mix: Optional[Dict[str, float]] = None, seed: int = 0):
+        self.users = users
+        self.groups = groups
+        self.mix = mix or DEFAULT_MIX
+        self.random = random.Random(seed)
+
+        self._update_ids = iter(range(1, 1 << 62))
+        self._message_ids = iter(range(1, 1 << 62))
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+    def _chat(self, chat_id: int) -> dict:
+        return {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}
+
+    def _message(self, user_id: int, chat_id: int, text: str, **fields) -> dict:
+        command = text.split(maxsplit=1)[0]
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": self._user(user_id),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            **fields,
+        }
+
+    def _photo(self, user_id: int, chat_id: int) -> dict:
+        # a handful of photos per user, so the image cache gets hits and misses
+        file_id = f"photo-{user_id}-{self.random.randrange(3)}"
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": self._user(user_id),
+            "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1920, "height": 1080}],
+        }
+
+    def _callback(self, user_id: int, chat_id: int, data: str) -> dict:
+        return {
+            "id": str(next(self._message_ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(chat_id),
+            "data": f"{data}:{user_id}",
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": self._chat(chat_id),
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                "text": "...",
+            },
+        }
+
+    def chats_of(self, user_id: int) -> List[int]:
+        """The private chat of ``user_id`` and the group it is in, if any."""
+        if not self.groups:
+            return [user_id]
+        return [user_id, -1000 - user_id % self.groups]
+
+    def introductions(self) -> Iterator[tuple]:
+        """A ``/start`` from every user in each of its chats."""
+        for user_id in range(1000, 1000 + self.users):
+            for chat_id in self.chats_of(user_id):
+                yield "start", self.update("start", user_id, chat_id)
+
+    def update(
+        self,
+        kind: str,
+        user_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        data: Optional[str] = None,
+    ) -> dict:
+        """A raw update of ``kind`` from a random user, unless one is given.
+
+        :param data: Button of a ``config_callback``, picked at random by default.
+        """
+        if user_id is None:
+            user_id = 1000 + self.random.randrange(self.users)
+        if chat_id is None:
+            chats = self.chats_of(user_id)
+            chat_id = chats[-1] if self.random.random() < 0.3 else chats[0]
+
+        question = f"question {self.random.randrange(50)}"
+
+        if kind == "start":
+            payload = {"message": self._message(user_id, chat_id, "/start")}
+        elif kind == "ask":
+            payload = {"message": self._message(user_id, chat_id, f"/ask {question}")}
+        elif kind == "ask_photo":
+            # commands only come with text, so photos are asked about in replies
+            payload = {
+                "message": self._message(
+                    user_id,
+                    chat_id,
+                    f"/ask what is in this picture? {question}",
+                    reply_to_message=self._photo(user_id, chat_id),
+                )
+            }
+        elif kind == "imagine":
+            payload = {"message": self._message(user_id, chat_id, f"/imagine a donkey, {question}")}
+        elif kind == "config":
+            payload = {"message": self._message(user_id, chat_id, "/config")}
+        elif kind == "config_callback":
+            data = data or self.random.choice(CONFIG_BUTTONS)
+            payload = {"callback_query": self._callback(user_id, chat_id, data)}
+        elif kind == "clear_history":
+            payload = {"message": self._message(user_id, chat_id, "/clear_history")}
+        elif kind == "clear_history_confirm":
+            payload = {"callback_query": self._callback(user_id, chat_id, "ch_confirm_yes")}
+        else:
+            raise ValueError(f"Unknown update kind: {kind}")
+
+        return {"update_id": next(self._update_ids), **payload}
+
+    def generate(self, count: int) -> Iterator[tuple]:
+        kinds = list(self.mix)
+        weights = [self.mix[kind] for kind in kinds]
+        for _ in range(count):
+            kind = self.random.choices(kinds, weights)[0]
+            yield kind, self.update(kind)
+
+
+@dataclass
+class Report:
+    database: str
+    updates: int = 0
+    elapsed: float = 0.0
+    failed: int = 0
+    statements: int = 0
+    peak_rss: int = 0
+    latencies: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+    # update kind -> (statements, round trips) of each update
+    queries: Dict[str, List[tuple]] = field(default_factory=lambda: defaultdict(list))
+    telegram_calls: Dict[str, int] = field(default_factory=dict)
+    provider_requests: int = 0
+
+    @property
+    def throughput(self) -> float:
+        return self.updates / self.elapsed if self.elapsed else 0.0
+
+    def handlers(self) -> Dict[str, Dict[str, float]]:
+        handlers = {}
+        for kind, values in sorted(self.latencies.items()):
+            statements, round_trips = zip(*self.queries[kind]) if self.queries.get(kind) else ((0,), (0,))
+            handlers[kind] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "statements": sum(statements) / len(statements),
+                "max_statements": max(statements),
+                "round_trips": sum(round_trips) / len(round_trips),
+            }
+        return handlers
+
+    def to_dict(self) -> dict:
+        return {
+            "database": self.database,
+            "updates": self.updates,
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+            "failed": self.failed,
+            "statements": self.statements,
+            "statements_per_update": self.statements / self.updates if self.updates else 0.0,
+            "peak_rss": self.peak_rss,
+            "handlers": self.handlers(),
+            "telegram_calls": self.telegram_calls,
+            "provider_requests": self.provider_requests,
+        }
+
+    def format(self) -> str:
+        lines = [
+            f"database          {self.database}",
+            f"updates           {self.updates} in {self.elapsed:.2f}s ({self.throughput:.1f}/s)",
+            f"failed            {self.failed}",
+            # handlers' statements plus the batched history writes
+            f"db statements     {self.statements} ({self.statements / max(self.updates, 1):.2f}/update)",
+            f"peak rss          {self.peak_rss / 1024 / 1024:.1f} MiB",
+            f"provider requests {self.provider_requests}",
+            f"bot api calls     {sum(self.telegram_calls.values())}",
+            "",
+            f"{'handler':<24}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'stmts':>8}{'max':>6}{'trips':>8}",
+        ]
+        for kind, stats in self.handlers().items():
+            lines.append(
+                f"{kind:<24}{stats['count']:>7}"
+                + "".join(f"{stats[q] * 1000:>10.1f}" for q in ("p50", "p95", "p99"))
+                + f"{stats['statements']:>8.2f}{stats['max_statements']:>6}{stats['round_trips']:>8.2f}"
+            )
+        return "\n".join(lines)
+
+
+def peak_rss() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+class Harness:
+    """Runs the bot against the fakes, see :func:`run` for a one-shot benchmark.
+
+    Everything it starts is bound to the running event loop, so ``start``,
+    ``replay`` and ``stop`` must all be awaited in the same one.
+    """
+
+    def __init__(
+        self,
+        database_url: Optional[str] = None,
+        latency: float = 0.0,
+        api_latency: float = 0.0,
+        cooldowns: bool = False,
+        flood_limits: bool = False,
+        reset: bool = False,
+    ):
+        """
+        :param database_url: Database to run on, a temporary SQLite file by default.
+        :param latency: Seconds the fake provider takes per answer or image.
+        :param api_latency: Seconds the fake Bot API takes per request.
+        :param cooldowns: Keep the per-user cooldowns of the handlers.
+        :param flood_limits: Keep pacing outgoing requests within the Bot API limits.
+        :param reset: Drop every table before starting.
+        """
+        self.bot = load_bot(database_url)
+        self.latency = latency
+        self.api_latency = api_latency
+        self.cooldowns = cooldowns
+        self.flood_limits = flood_limits
+        self.reset = reset
+
+        self.statements = 0
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Dict[str, List[tuple]] = defaultdict(list)
+
+        self._kinds: Dict[int, str] = {}
+        self._fed_at: Dict[int, float] = {}
+        self.telegram = None
+        self.provider = None
+
+    async def start(self) -> None:
+        from sqlalchemy import event
+        from telebot import types
+
+        from gpt_assistant import _defaults
+        from gpt_assistant.db import Base, count_queries, engine, init_db
+        from gpt_assistant.db.migrations import schema_migrations
+        from gpt_assistant.ratelimit import TokenBucket
+        from tests import fake_provider
+        from tests.fake_telegram import FakeTelegram
+
+        self._types = types
+        self.telegram = FakeTelegram(latency=self.api_latency)
+        await self.telegram.start()
+        self.telegram.install()
+
+        self.provider = fake_provider.install(
+            latency=self.latency, image_base_url=f"{self.telegram.url}/images"
+        )
+        _defaults.DEFAULT_CONFIG_VALUES.update(
+            provider=self.provider.__name__,
+            language_model=self.provider.default_model,
+            image_model=self.provider.default_image_model,
+        )
+
+        if not self.cooldowns:
+            for limiter in self.bot.rate_limiters.values():
+                limiter.rate = limiter.burst = 1e9
+
+        if not self.flood_limits:
+            # the fake API has no limits, and waiting for them would hide everything else
+            outbound = self.bot.outbound
+            outbound.chat_rate = outbound.chat_burst = 1e9
+            outbound._global = TokenBucket(1e9, 1e9, time.monotonic())
+
+        if self.reset:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+                await conn.run_sync(schema_migrations.drop, checkfirst=True)
+
+        await init_db()
+        await self.bot.warm_membership_cache()
+        await self.bot.client_pool.start()
+
+        event.listen(engine.sync_engine, "before_cursor_execute", self._count_statement)
+
+        dispatcher = self.bot.dispatcher
+        handler = dispatcher.handler
+
+        async def timed(updates):
+            # the dispatcher hands updates over one at a time
+            with count_queries() as count:
+                try:
+                    await handler(updates)
+                finally:
+                    finished = time.perf_counter()
+                    for update in updates:
+                        fed_at = self._fed_at.pop(update.update_id, None)
+                        if fed_at is not None:
+                            kind = self._kinds.pop(update.update_id)
+                            self.latencies[kind].append(finished - fed_at)
+                            self.queries[kind].append((count.statements, count.round_trips))
+
+        dispatcher.handler = timed
+        self._handler = handler
+
+    def _count_statement(self, *args) -> None:
+        self.statements += 1
+
+    async def feed(self, updates: List[tuple]) -> None:
+        """Hands ``(kind, raw update)`` pairs to the bot the way polling does."""
+        parsed = []
+        now = time.perf_counter()
+        for kind, raw in updates:
+            update = self._types.Update.de_json(raw)
+            self._kinds[update.update_id] = kind
+            self._fed_at[update.update_id] = now
+            parsed.append(update)
+        await self.bot.bot.process_new_updates(parsed)
+
+    async def handle(self, updates: List[tuple]) -> None:
+        """Feeds ``updates`` and waits until they are handled."""
+        await self.feed(updates)
+        await self.drain()
+
+    async def drain(self, timeout: float = 300) -> None:
+        """Waits until every update is handled and its side effects are written."""
+        await self.bot.dispatcher.join(timeout=timeout)
+        await self.bot.outbound.join(timeout=timeout)
+        await self.bot.message_writer.flush()
+
+    def failures(self) -> int:
+        from gpt_assistant.metrics import handler_latency
+
+        return sum(
+            sum(counts) for (_, outcome), (counts, _) in handler_latency._values.items() if outcome == "error"
+        ) + self.bot.dispatcher.failed
+
+    async def replay(
+        self,
+        workload: Workload,
+        updates: int,
+        batch_size: int = 100,
+        rate: float = 0.0,
+        warm_up: bool = True,
+    ) -> Report:
+        """Feeds ``updates`` updates of ``workload`` and reports on them.
+
+        :param batch_size: Updates handed over at once, like one getUpdates response.
+        :param rate: Updates per second to feed, or 0 to feed them as fast as possible.
+        :param warm_up: Register every user before the clock starts, so the run
+            measures returning users rather than first contacts.
+        """
+        from gpt_assistant.db import engine
+
+        if warm_up:
+            introductions = list(workload.introductions())
+            for start in range(0, len(introductions), batch_size):
+                await self.feed(introductions[start : start + batch_size])
+            await self.drain()
+
+        # only count what the workload does, not the setup
+        failed_before = self.failures()
+        self.statements = 0
+        self.latencies.clear()
+        self.queries.clear()
+        self.telegram.calls.clear()
+        self.provider.requests = 0
+
+        started = time.perf_counter()
+        batch = []
+        for number, item in enumerate(workload.generate(updates), 1):
+            batch.append(item)
+            if len(batch) == batch_size or number == updates:
+                await self.feed(batch)
+                batch = []
+                if rate:
+                    delay = started + number / rate - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    # let the handlers start, as between two getUpdates calls
+                    await asyncio.sleep(0)
+
+        await self.drain()
+        elapsed = time.perf_counter() - started
+
+        return Report(
+            database=engine.dialect.name,
+            updates=updates,
+            elapsed=elapsed,
+            failed=self.failures() - failed_before,
+            statements=self.statements,
+            peak_rss=peak_rss(),
+            latencies=dict(self.latencies),
+            queries=dict(self.queries),
+            telegram_calls=dict(self.telegram.calls),
+            provider_requests=self.provider.requests,
+        )
+
+    async def stop(self) -> None:
+        from sqlalchemy import event
+        from telebot import asyncio_helper
+
+        from gpt_assistant.db import engine
+
+        event.remove(engine.sync_engine, "before_cursor_execute", self._count_statement)
+        self.bot.dispatcher.handler = self._handler
+        await self.bot.message_writer.stop()
+        await self.bot.client_pool.close()
+        await engine.dispose()
+        if asyncio_helper.session_manager.session is not None:
+            await asyncio_helper.session_manager.session.close()
+        await self.telegram.stop()
+
+
+async def run(
+    updates: int = 1000,
+    users: int = 100,
+    groups: int = 10,
+    mix: Optional[Dict[str, float]] = None,
+    seed: int = 0,
+    batch_size: int = 100,
+    rate: float = 0.0,
+    warm_up: bool = True,
+    **options,
+) -> Report:
+    """Runs a whole benchmark, ``options`` go to :class:`Harness`."""
+    harness = Harness(**options)
+    await harness.start()
+    try:
+        return await harness.replay(
+            Workload(users, groups, mix, seed),
+            updates,
+            batch_size=batch_size,
+            rate=rate,
+            warm_up=warm_up,
+        )
+    finally:
+        await harness.stop()
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        kind, _, weight = item.partition("=")
+        if kind.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown update kind {kind.strip()!r}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmark", description=__doc__.split("\n")[0])
+    parser.add_argument("--updates", type=int, default=1000, help="number of updates to replay")
+    parser.add_argument("--users", type=int, default=100, help="number of distinct users")
+    parser.add_argument("--groups", type=int, default=10, help="number of group chats")
+    parser.add_argument("--batch-size", type=int, default=100, help="updates handed over at once")
+    parser.add_argument("--rate", type=float, default=0.0, help="updates per second, 0 for as fast as possible")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake provider takes to answer")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds the fake Bot API takes per request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        help="comma separated kind=weight pairs, kinds: " + ", ".join(DEFAULT_MIX),
+    )
+    parser.add_argument("--no-warm-up", action="store_true", help="don't register the users before the run")
+    parser.add_argument("--database-url", help="database to run on instead of a temporary SQLite file")
+    parser.add_argument("--reset", action="store_true", help="drop every table before starting")
+    parser.add_argument("--cooldowns", action="store_true", help="keep the per-user cooldowns")
+    parser.add_argument("--flood-limits", action="store_true", help="keep pacing requests within the Bot API limits")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(
+        run(
+            updates=args.updates,
+            users=args.users,
+            groups=args.groups,
+            batch_size=args.batch_size,
+            rate=args.rate,
+            seed=args.seed,
+            mix=args.mix,
+            warm_up=not args.no_warm_up,
+            database_url=args.database_url,
+            latency=args.latency,
+            api_latency=args.api_latency,
+            cooldowns=args.cooldowns,
+            flood_limits=args.flood_limits,
+            reset=args.reset,
+        )
+    )
+
+    print(report.format())
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report.to_dict(), file, indent=2)
+
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+
+from tests.benchmark import Harness, load_bot
+
+# settings are read once, at import, so the bot has to be configured before
+# the test modules import anything from it
+load_bot()
+
+
+@pytest.fixture(scope="session")
+def loop():
+    # the bot's queues, sessions and engine outlive a test, so they all share one loop
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def harness(loop):
+    harness = Harness()
+    loop.run_until_complete(harness.start())
+    yield harness
+    loop.run_until_complete(harness.stop())
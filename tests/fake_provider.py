@@ -0,0 +1,89 @@
+"""A deterministic g4f provider, so benchmarks measure the bot rather than the network."""
+
+import asyncio
+import hashlib
+from typing import List, Optional
+
+import g4f
+from g4f.providers.base_provider import AsyncGeneratorProvider, ProviderModelMixin
+from g4f.providers.response import ImageResponse
+
+from gpt_assistant.providers import provider_registry
+
+
+class FakeProvider(AsyncGeneratorProvider, ProviderModelMixin):
+    """Answers every prompt with a digest of the conversation after ``latency`` seconds.
+
+    Answers are streamed in ``chunks`` pieces, and image requests return links
+    to ``image_base_url`` (usually a :class:`tests.fake_telegram.FakeTelegram`).
+    """
+
+    label = "Fake"
+    working = True
+    needs_auth = False
+    supports_stream = True
+    supports_system_message = True
+    supports_message_history = True
+
+    default_model = "fake-model"
+    default_image_model = "fake-image"
+    image_models = [default_image_model]
+    models = [default_model, *image_models]
+
+    latency: float = 0.0
+    chunks: int = 8
+    answer_length: int = 400
+    images_per_prompt: int = 1
+    image_base_url: str = "http://127.0.0.1/images"
+
+    requests: int = 0
+
+    @classmethod
+    def configure(cls, **options) -> None:
+        for name, value in options.items():
+            if not hasattr(cls, name):
+                raise AttributeError(f"FakeProvider has no option {name!r}")
+            setattr(cls, name, value)
+
+    @classmethod
+    def answer(cls, messages: List[dict]) -> str:
+        digest = hashlib.sha256(repr(messages).encode()).hexdigest()
+        text = f"Answer to {len(messages)} messages: "
+        return (text + digest * (cls.answer_length // len(digest) + 1))[: cls.answer_length]
+
+    @classmethod
+    async def create_async_generator(
+        cls, model: str, messages: List[dict], proxy: Optional[str] = None, **kwargs
+    ):
+        cls.requests += 1
+
+        if model in cls.image_models:
+            await asyncio.sleep(cls.latency)
+            prompt = kwargs.get("prompt") or messages[-1]["content"]
+            digest = hashlib.sha256(prompt.encode()).hexdigest()[:16]
+            yield ImageResponse(
+                [f"{cls.image_base_url}/{digest}-{n}.png" for n in range(cls.images_per_prompt)],
+                prompt,
+            )
+            return
+
+        text = cls.answer(messages)
+        if not kwargs.get("stream"):
+            await asyncio.sleep(cls.latency)
+            yield text
+            return
+
+        size = -(-len(text) // cls.chunks)
+        for start in range(0, len(text), size):
+            await asyncio.sleep(cls.latency / cls.chunks)
+            yield text[start : start + size]
+
+
+def install(**options) -> type:
+    """Makes :class:`FakeProvider` the only provider the bot knows about."""
+    FakeProvider.configure(**options)
+    # the bot looks its providers up by name on g4f.Provider
+    setattr(g4f.Provider, FakeProvider.__name__, FakeProvider)
+    g4f.debug.version_check = False
+    provider_registry.build([FakeProvider])
+    return FakeProvider
@@ -0,0 +1,138 @@
+"""A local stand-in for the Telegram Bot API, good enough for the bot's handlers.
+
+Every request is answered from memory with a plausible result, optionally
+after ``latency`` seconds, and counted per method. It also serves the files
+behind ``getFile`` and the images a fake provider links to.
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from io import BytesIO
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+from PIL import Image
+from telebot import asyncio_helper
+
+
+def make_image(width: int, height: int, image_format: str = "JPEG") -> bytes:
+    # a gradient compresses like a photo, unlike a flat color
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    output = BytesIO()
+    image.save(output, format=image_format, quality=90)
+    return output.getvalue()
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0, photo_size: tuple = (1920, 1080)):
+        """
+        :param latency: Seconds every API request takes.
+        :param photo_size: Size of the photos users "send".
+        """
+        self.latency = latency
+        self.photo = make_image(*photo_size)
+        self.generated = make_image(512, 512, "PNG")
+
+        self.calls: Counter = Counter()
+        self.sent: Dict[int, int] = Counter()
+
+        self._message_ids = itertools.count(1_000_000)
+        self._file_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        app.router.add_get("/images/{name}", self.handle_image)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    def install(self) -> None:
+        """Points telebot at this server."""
+        asyncio_helper.API_URL = self.url + "/bot{0}/{1}"
+        asyncio_helper.FILE_URL = self.url + "/file/bot{0}/{1}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def image_url(self, name: str) -> str:
+        return f"{self.url}/images/{name}.png"
+
+    def _message(self, chat_id: Any, **fields) -> Dict[str, Any]:
+        chat_id = int(chat_id)
+        self.sent[chat_id] += 1
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+            **fields,
+        }
+
+    def _photo(self) -> list:
+        file_id = f"generated-{next(self._file_ids)}"
+        return [
+            {"file_id": file_id, "file_unique_id": file_id, "width": 512, "height": 512}
+        ]
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+
+        params: Dict[str, Any] = dict(request.query)
+        if request.content_type == "application/json":
+            params.update(await request.json())
+        elif request.content_type == "multipart/form-data":
+            params.update(await request.post())
+        elif request.can_read_body:
+            # telebot sends form fields in the body of GET requests too
+            params.update(parse_qsl(await request.text()))
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        result = self.result(method, params)
+        return web.json_response({"ok": True, "result": result})
+
+    def result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bot", "username": "fake_bot"}
+
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params["chat_id"], text=str(params.get("text", "")))
+
+        if method == "sendDocument":
+            return self._message(params["chat_id"], document={"file_id": "doc", "file_unique_id": "doc"})
+
+        if method == "sendMediaGroup":
+            media = json.loads(params["media"])
+            return [self._message(params["chat_id"], photo=self._photo()) for _ in media]
+
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": file_id, "file_path": f"photos/{file_id}.jpg"}
+
+        # sendChatAction, answerCallbackQuery, deleteWebhook...
+        return True
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        self.calls["downloadFile"] += 1
+        return web.Response(body=self.photo, content_type="image/jpeg")
+
+    async def handle_image(self, request: web.Request) -> web.Response:
+        self.calls["image"] += 1
+        return web.Response(body=self.generated, content_type="image/png")
@@ -0,0 +1,41 @@
+"""Fails a test when the code under it makes more database round trips than it declares.
+
+    with query_budget(statements=3, name="/ask"):
+        loop.run_until_complete(harness.handle([workload.update("ask")]))
+
+Everything awaited inside the block counts, including the tasks it starts,
+but not the batched history writes, which belong to no update.
+"""
+
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from gpt_assistant.db import QueryCount, count_queries
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def check_budget(count: QueryCount, statements: int, round_trips: Optional[int] = None, name: str = "block") -> None:
+    over = []
+    if count.statements > statements:
+        over.append(f"{count.statements} statements (budget {statements})")
+    if round_trips is not None and count.round_trips > round_trips:
+        over.append(f"{count.round_trips} round trips (budget {round_trips})")
+
+    if over:
+        queries = "\n".join(f"  {number}. {query}" for number, query in enumerate(count.queries or (), 1))
+        raise QueryBudgetExceeded(f"{name} went over its query budget with {' and '.join(over)}:\n{queries}")
+
+
+@contextmanager
+def query_budget(statements: int, round_trips: Optional[int] = None, name: str = "block") -> Iterator[QueryCount]:
+    """
+    :param statements: Most SQL statements the block may execute.
+    :param round_trips: Most round trips (statements, commits and rollbacks) it may make.
+    :param name: What the block does, for the failure message.
+    """
+    with count_queries(record=True) as count:
+        yield count
+    check_budget(count, statements, round_trips, name)
@@ -0,0 +1,69 @@
+from telebot.types import Update
+
+from backlog import prune_backlog
+
+NOW = 1_700_000_000
+
+
+def message_update(update_id: int, text: str, user_id: int = 1, age: int = 0) -> Update:
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": NOW - age,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+                "text": text,
+            },
+        }
+    )
+
+
+def callback_update(update_id: int, keyboard_message_id: int, user_id: int = 1) -> Update:
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "chat_instance": "1",
+                "data": "config",
+                "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+                "message": {
+                    "message_id": keyboard_message_id,
+                    "date": NOW,
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "settings",
+                },
+            },
+        }
+    )
+
+
+def ids(updates) -> list:
+    return [update.update_id for update in updates]
+
+
+def test_drops_updates_older_than_max_age():
+    updates = [message_update(1, "old", age=600), message_update(2, "new", user_id=2, age=10)]
+
+    assert ids(prune_backlog(updates, max_age=300, now=NOW)) == [2]
+    assert ids(prune_backlog(updates, max_age=None, now=NOW)) == [1, 2]
+
+
+def test_keeps_the_newest_update_of_each_kind_per_user():
+    updates = [
+        message_update(1, "/ask first"),
+        message_update(2, "hello"),
+        message_update(3, "/ask second"),
+        message_update(4, "/ask other user", user_id=2),
+        message_update(5, "hello again"),
+    ]
+
+    assert ids(prune_backlog(updates, max_age=None, now=NOW)) == [3, 4, 5]
+
+
+def test_collapses_presses_on_the_same_keyboard():
+    updates = [callback_update(1, 50), callback_update(2, 51), callback_update(3, 50)]
+
+    assert ids(prune_backlog(updates, max_age=None, now=NOW)) == [2, 3]
@@ -0,0 +1,30 @@
+from tests.benchmark import DEFAULT_MIX, Workload, percentile
+
+
+def test_percentile():
+    values = [float(n) for n in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile(values, 100) == 100.0
+    assert percentile([], 50) == 0.0
+
+
+def test_workload_is_reproducible():
+    def kinds(seed):
+        return [(kind, raw["update_id"]) for kind, raw in Workload(20, 4, seed=seed).generate(100)]
+
+    assert kinds(1) == kinds(1)
+    assert kinds(1) != kinds(2)
+
+
+def test_replay(harness, loop):
+    report = loop.run_until_complete(
+        harness.replay(Workload(users=10, groups=2, seed=0), 200, batch_size=50)
+    )
+
+    assert report.failed == 0
+    assert set(report.latencies) == set(DEFAULT_MIX)
+    assert sum(len(values) for values in report.latencies.values()) == 200
+    assert report.provider_requests > 0
+    assert report.telegram_calls["sendMediaGroup"] > 0
+    assert report.statements > 0
@@ -0,0 +1,70 @@
+import asyncio
+import gc
+import warnings
+
+import pytest
+
+from generations import GenerationCancelled, GenerationRegistry
+
+
+async def noop():
+    return "done"
+
+
+def test_cancels_the_running_generation(loop):
+    registry = GenerationRegistry()
+
+    async def scenario():
+        generation = registry.start(1, 2, "ask", 10)
+        task = asyncio.ensure_future(generation.run(asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        assert registry.cancel(1, 2)
+        with pytest.raises(GenerationCancelled):
+            await task
+
+    loop.run_until_complete(scenario())
+
+
+def test_cancel_covers_generations_not_started_yet(loop):
+    registry = GenerationRegistry()
+
+    # /cancel (message 12) is handled before the queued /ask (message 10) starts
+    assert not registry.cancel(1, 2, before=12)
+
+    generation = registry.start(1, 2, "ask", 10)
+    with pytest.raises(GenerationCancelled):
+        loop.run_until_complete(generation.run(noop()))
+
+    # a message sent after the cancellation runs, and spends it
+    generation = registry.start(1, 2, "ask", 13)
+    assert loop.run_until_complete(generation.run(noop())) == "done"
+    assert registry.start(1, 2, "ask", 11).cancelled is False
+
+
+def test_pending_cancel_respects_kind(loop):
+    registry = GenerationRegistry()
+    registry.cancel(1, 2, kind="ask", before=20)
+
+    assert registry.start(1, 2, "imagine", 15).cancelled is False
+    assert registry.start(1, 2, "ask", 16).cancelled is True
+    assert registry.start(3, 2, "ask", 16).cancelled is False
+
+
+def test_cancel_before_the_request_first_runs(loop):
+    registry = GenerationRegistry()
+
+    async def scenario():
+        generation = registry.start(1, 2, "ask", 30)
+        task = asyncio.ensure_future(generation.run(noop()))
+        # run() gets as far as scheduling the request, which hasn't taken a step yet
+        await asyncio.sleep(0)
+        registry.cancel(1, 2)
+        with pytest.raises(GenerationCancelled):
+            await task
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        loop.run_until_complete(scenario())
+        gc.collect()
+
+    assert not [w for w in caught if "never awaited" in str(w.message)]
@@ -0,0 +1,124 @@
+import pytest
+
+from gpt_assistant import health
+from gpt_assistant.health import CLOSED, HALF_OPEN, OPEN, ProviderHealth
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(health, "time", clock)
+    return clock
+
+
+def fail(breaker: ProviderHealth, provider: str, times: int = 1) -> None:
+    for _ in range(times):
+        breaker.record_failure(provider, "gpt", 0.1)
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = ProviderHealth(failure_threshold=3, min_samples=100, open_seconds=30)
+
+    fail(breaker, "a", 2)
+    assert breaker.stats("a", "gpt").state == CLOSED
+
+    fail(breaker, "a")
+    assert breaker.stats("a", "gpt").state == OPEN
+    assert not breaker.available("a", "gpt")
+    assert breaker.candidates(["a", "b"], "gpt") == ["b"]
+
+
+def test_a_success_resets_the_consecutive_failures(clock):
+    breaker = ProviderHealth(failure_threshold=3, min_samples=100)
+
+    fail(breaker, "a", 2)
+    breaker.record_success("a", "gpt", 0.1)
+    fail(breaker, "a", 2)
+
+    assert breaker.stats("a", "gpt").state == CLOSED
+
+
+def test_opens_on_the_error_rate(clock):
+    breaker = ProviderHealth(failure_threshold=100, error_rate_threshold=0.5, min_samples=4)
+
+    for _ in range(2):
+        breaker.record_success("a", "gpt", 0.1)
+        fail(breaker, "a")
+
+    assert breaker.snapshot()[("a", "gpt")]["error_rate"] == 0.5
+    assert breaker.stats("a", "gpt").state == OPEN
+
+
+def test_half_open_trial_closes_or_reopens(clock):
+    breaker = ProviderHealth(failure_threshold=1, open_seconds=30)
+    fail(breaker, "a")
+
+    clock.now += 30
+    assert breaker.available("a", "gpt")
+
+    # the trial request keeps everyone else away until it finishes
+    breaker.acquire("a", "gpt")
+    assert breaker.stats("a", "gpt").state == HALF_OPEN
+    assert not breaker.available("a", "gpt")
+
+    fail(breaker, "a")
+    assert breaker.stats("a", "gpt").state == OPEN
+
+    clock.now += 30
+    breaker.acquire("a", "gpt")
+    breaker.record_success("a", "gpt", 0.1)
+    assert breaker.stats("a", "gpt").state == CLOSED
+    assert breaker.available("a", "gpt")
+
+
+def test_keeps_the_first_provider_when_every_circuit_is_open(clock):
+    breaker = ProviderHealth(failure_threshold=1)
+    fail(breaker, "a")
+    fail(breaker, "b")
+
+    assert breaker.candidates(["a", "b"], "gpt") == ["a"]
+
+
+def test_call_fails_over_to_the_next_provider(clock, loop):
+    breaker = ProviderHealth(failure_threshold=1)
+
+    async def request(provider: str) -> str:
+        if provider == "a":
+            raise RuntimeError("down")
+        return f"answer from {provider}"
+
+    answered_by, answer = loop.run_until_complete(breaker.call(["a", "b"], "gpt", request))
+
+    assert (answered_by, answer) == ("b", "answer from b")
+    assert breaker.stats("a", "gpt").state == OPEN
+    assert breaker.stats("b", "gpt").state == CLOSED
+
+
+def test_call_raises_the_last_error_when_every_provider_fails(clock, loop):
+    breaker = ProviderHealth()
+
+    async def request(provider: str) -> str:
+        raise RuntimeError(provider)
+
+    with pytest.raises(RuntimeError, match="b"):
+        loop.run_until_complete(breaker.call(["a", "b"], "gpt", request))
+
+
+def test_cold_providers_are_hedged_before_they_time_out(clock):
+    breaker = ProviderHealth(hedge_cold_delay=10, timeouts={"slow": 60})
+
+    assert breaker.hedge_delay("a", "gpt", 2) == 10
+    assert breaker.hedge_delay("a", "gpt", 2, timeout=8) == 4
+    assert breaker.hedge_delay("slow", "gpt", 2, timeout=8) == 10
+    assert breaker.hedge_delay("a", "gpt", 5, timeout=8) == 5
+
+    breaker.record_success("a", "gpt", 3.0)
+    assert breaker.hedge_delay("a", "gpt", 2, timeout=8) == 3.0
@@ -0,0 +1,41 @@
+from gpt_assistant.crud.messages import fit_turns
+from gpt_assistant.db import Message
+
+
+def turn(message_id: int, question: int, answer: int) -> list:
+    """A turn newest first, as get_messages returns it, sized in tokens."""
+    return [
+        Message(message_id=message_id, role="assistant", content="a" * answer * 4, token_count=answer),
+        Message(message_id=message_id, role="user", content="q" * question * 4, token_count=question),
+    ]
+
+
+def test_keeps_whole_turns():
+    messages = turn(3, 10, 10) + turn(2, 10, 10) + turn(1, 10, 10)
+
+    kept = fit_turns(messages, 50)
+
+    assert [(m.message_id, m.role) for m in kept] == [
+        (3, "assistant"), (3, "user"), (2, "assistant"), (2, "user"),
+    ]
+
+
+def test_never_keeps_an_answer_without_its_question():
+    # the row limit cut turn 1 in half
+    messages = turn(2, 5, 5) + turn(1, 5, 5)[:1]
+
+    assert [m.message_id for m in fit_turns(messages, 100)] == [2, 2]
+
+
+def test_truncates_the_latest_turn():
+    messages = turn(2, 10, 400) + turn(1, 5, 5)
+
+    kept = fit_turns(messages, 100)
+
+    assert [(m.message_id, m.role) for m in kept] == [(2, "assistant"), (2, "user")]
+    # the short question is kept whole, the answer gets the rest
+    assert kept[1].content == messages[1].content
+    assert kept[0].token_count == 90
+    assert len(kept[0].content) <= 90 * 4 + 1
+    # the session's rows are left alone
+    assert messages[0].token_count == 400
@@ -0,0 +1,38 @@
+import json
+
+from sqlalchemy import text
+
+from gpt_assistant.crud.images import add_image_generation, find_image_generation, generation_cache
+from gpt_assistant.crud.chats import register_chat
+from gpt_assistant.crud.users import register_user
+from gpt_assistant.db import SessionLocal
+
+
+def test_file_ids_are_stored_as_a_json_list(harness, loop):
+    async def scenario():
+        async with SessionLocal() as session:
+            await register_user(session, 70_001)
+            await register_chat(session, 70_001)
+            await add_image_generation(
+                session,
+                output_file_hashes=["a", "b"],
+                prompt="a donkey in space",
+                message_id=1,
+                author_id=70_001,
+                chat_id=70_001,
+                image_model="fake-image",
+            )
+            raw = await session.execute(
+                text("SELECT output_file_hashes FROM image_generations WHERE author_id = 70001")
+            )
+            stored = raw.scalar()
+
+        generation_cache.clear()
+        async with SessionLocal() as session:
+            found = await find_image_generation(session, "A donkey  in space", "fake-image")
+        return stored, found
+
+    stored, found = loop.run_until_complete(scenario())
+
+    assert json.loads(stored) == ["a", "b"]
+    assert found == ["a", "b"]
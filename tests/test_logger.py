@@ -0,0 +1,24 @@
+import sys
+from logging import ERROR, LogRecord
+from queue import SimpleQueue
+
+from gpt_assistant._logger import LazyQueueHandler
+
+
+def test_records_are_queued_unformatted():
+    queue = SimpleQueue()
+    handler = LazyQueueHandler(queue)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        exc_info = sys.exc_info()
+    record = LogRecord("bot", ERROR, __file__, 1, "failed for %s", ("user",), exc_info)
+
+    handler.handle(record)
+    queued = queue.get_nowait()
+
+    # the listener thread does the interpolation and the traceback
+    assert queued.args == ("user",)
+    assert queued.exc_info == exc_info
+    assert queued.exc_text is None
+    assert queued.getMessage() == "failed for user"
@@ -0,0 +1,58 @@
+import asyncio
+
+from outbound import OutboundScheduler
+
+
+class RecordingBot:
+    def __init__(self):
+        self.calls = []
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.calls.append(("edit", message_id, text))
+        return True
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(("send", chat_id, text))
+        return True
+
+
+def run(loop, requests):
+    bot = RecordingBot()
+    # no burst, so everything after a chat's first request queues (for a millisecond)
+    # and can be coalesced, without slowing the tests down
+    outbound = OutboundScheduler(bot, rate=1000, chat_rate=1000, chat_burst=1)
+
+    async def scenario():
+        results = [asyncio.ensure_future(request(outbound)) for request in requests]
+        await asyncio.gather(*results)
+        return outbound
+
+    return loop.run_until_complete(scenario()), bot.calls
+
+
+def test_merges_consecutive_edits(loop):
+    outbound, calls = run(loop, [
+        lambda o: o.send_message(1, "first"),
+        lambda o: o.edit_message_text("draft 1", 1, 10),
+        lambda o: o.edit_message_text("draft 2", 1, 10),
+    ])
+
+    assert calls == [("send", 1, "first"), ("edit", 10, "draft 2")]
+    assert outbound.coalesced == 1
+
+
+def test_keeps_order_around_other_requests(loop):
+    outbound, calls = run(loop, [
+        lambda o: o.send_message(1, "first"),
+        lambda o: o.edit_message_text("draft 1", 1, 10),
+        lambda o: o.send_message(1, "second"),
+        lambda o: o.edit_message_text("draft 2", 1, 10),
+    ])
+
+    assert calls == [
+        ("send", 1, "first"),
+        ("edit", 10, "draft 1"),
+        ("send", 1, "second"),
+        ("edit", 10, "draft 2"),
+    ]
+    assert outbound.coalesced == 0
@@ -0,0 +1,83 @@
+import itertools
+
+import pytest
+from sqlalchemy import text
+
+from gpt_assistant.db import SessionLocal, count_queries
+from tests.benchmark import Workload
+from tests.querybudget import QueryBudgetExceeded, query_budget
+
+# (statements, round trips) of one update from a user the bot already knows,
+# whose config is cached
+RETURNING_USER_BUDGETS = {
+    "start": (1, 2),
+    "ask": (2, 3),
+    "ask_photo": (1, 2),
+    "imagine": (1, 2),
+    "config": (0, 0),
+    "clear_history": (1, 2),
+    "clear_history_confirm": (1, 2),
+    "config_callback:conf_streaming": (2, 3),
+    "config_callback:conf_cache": (2, 3),
+    "config_callback:conf_provider": (0, 0),
+    "config_callback:conf_lm": (0, 0),
+}
+
+# the same for the very first update of a user, which registers it
+FIRST_CONTACT_BUDGETS = {
+    "start": (6, 10),
+    "ask": (7, 11),
+    "imagine": (6, 10),
+    "config_callback:conf_streaming": (5, 8),
+}
+
+user_ids = itertools.count(50_000)
+
+
+def handle(harness, loop, case: str, returning: bool, budget: tuple) -> None:
+    kind, _, data = case.partition(":")
+    workload = Workload(users=1)
+    user_id = next(user_ids)
+
+    if returning:
+        loop.run_until_complete(harness.handle([("start", workload.update("start", user_id, user_id))]))
+
+    update = workload.update(kind, user_id, user_id, data=data or None)
+    statements, round_trips = budget
+    with query_budget(statements, round_trips, name=case):
+        loop.run_until_complete(harness.handle([(kind, update)]))
+
+
+@pytest.mark.parametrize("case", RETURNING_USER_BUDGETS)
+def test_returning_user(harness, loop, case):
+    handle(harness, loop, case, True, RETURNING_USER_BUDGETS[case])
+
+
+@pytest.mark.parametrize("case", FIRST_CONTACT_BUDGETS)
+def test_first_contact(harness, loop, case):
+    handle(harness, loop, case, False, FIRST_CONTACT_BUDGETS[case])
+
+
+def test_budget_exceeded(harness, loop):
+    async def select_twice():
+        async with SessionLocal() as session:
+            await session.execute(text("SELECT 1"))
+            await session.execute(text("SELECT 2"))
+
+    with pytest.raises(QueryBudgetExceeded, match="2 statements"):
+        with query_budget(1):
+            loop.run_until_complete(select_twice())
+
+
+def test_counts_nest(harness, loop):
+    async def select_one():
+        async with SessionLocal() as session:
+            await session.execute(text("SELECT 1"))
+
+    with count_queries() as outer:
+        loop.run_until_complete(select_one())
+        with count_queries() as inner:
+            loop.run_until_complete(select_one())
+
+    assert (inner.statements, outer.statements) == (1, 2)
+    assert outer.round_trips > outer.statements
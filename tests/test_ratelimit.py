@@ -0,0 +1,85 @@
+import pytest
+
+from gpt_assistant import ratelimit
+from gpt_assistant.ratelimit import RateLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def test_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(rate=2, capacity=4, now=0)
+    bucket.tokens = 0
+
+    assert bucket.delay(0) == 0.5
+    assert bucket.delay(1) == 0
+    assert bucket.tokens == 2
+    assert bucket.full_at() == 2
+
+    bucket.refill(10)
+    assert bucket.tokens == 4
+
+
+def test_allows_a_burst_then_rejects(clock):
+    limiter = RateLimiter(rate=1, burst=2)
+
+    assert limiter.acquire("user") == 0
+    assert limiter.acquire("user") == 0
+    assert limiter.acquire("user") is None
+    # keys don't share buckets
+    assert limiter.acquire("other") == 0
+
+    clock.now += 1
+    assert limiter.acquire("user") == 0
+
+    assert limiter.stats() == {"keys": 2, "allowed": 4, "delayed": 0, "rejected": 1}
+
+
+def test_delays_within_max_wait_and_queues_behind(clock):
+    limiter = RateLimiter(rate=1, burst=1)
+    limiter.acquire("user")
+
+    assert limiter.acquire("user", max_wait=3) == 1
+    # the previous wait reserved its token
+    assert limiter.acquire("user", max_wait=3) == 2
+    assert limiter.acquire("user", max_wait=1.5) is None
+
+    assert (limiter.delayed, limiter.rejected) == (2, 1)
+
+
+def test_evicts_refilled_buckets(clock):
+    limiter = RateLimiter(rate=1, burst=2)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    assert len(limiter) == 2
+
+    clock.now += 1
+    limiter.acquire("c")
+
+    # full buckets carry no state, empty ones are kept
+    assert len(limiter) == 1
+    assert limiter.acquire("c") == 0
+    assert limiter.acquire("c") is None
+
+
+def test_keeps_at_most_max_entries(clock):
+    limiter = RateLimiter(rate=1, burst=1, max_entries=2)
+    for key in ("a", "b", "c", "d"):
+        limiter.acquire(key)
+
+    assert len(limiter) == 2
+    # the least recently used keys went first
+    assert limiter.acquire("d") is None
+    assert limiter.acquire("a") == 0
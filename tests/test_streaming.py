@@ -0,0 +1,86 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+from streaming import StreamingReply
+from utils import ThinkFilter, no_need_to_think
+
+
+class RecordingBot:
+    def __init__(self):
+        self.calls = []
+        self._ids = itertools.count(100)
+
+    async def reply_to(self, message, text, parse_mode=None):
+        reply = SimpleNamespace(id=next(self._ids), chat=message.chat)
+        self.calls.append(("send", reply.id, text, parse_mode))
+        return reply
+
+    async def edit_message_text(self, text, chat_id, message_id, parse_mode=None):
+        self.calls.append(("edit", message_id, text, parse_mode))
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls.append(("delete", message_id))
+
+
+def message():
+    return SimpleNamespace(id=1, chat=SimpleNamespace(id=1))
+
+
+def test_close_stops_pending_flushes(loop):
+    bot = RecordingBot()
+    reply = StreamingReply(bot, message(), edit_interval=0.05)
+
+    async def scenario():
+        await reply.feed("Hello")
+        # held back by the interval, a flush is pending
+        await reply.feed(" world")
+        await reply.close()
+        # the handler reports the error, nothing may edit the reply after it
+        bot.calls.append(("error",))
+        await asyncio.sleep(0.1)
+
+    loop.run_until_complete(scenario())
+
+    assert bot.calls == [
+        ("send", 100, "Hello", ""),
+        ("edit", 100, "Hello world", None),
+        ("error",),
+    ]
+
+
+def test_close_after_finish_does_nothing(loop):
+    bot = RecordingBot()
+    reply = StreamingReply(bot, message(), edit_interval=0.05)
+
+    async def scenario():
+        await reply.feed("Hello")
+        await reply.finish()
+        await reply.close()
+
+    loop.run_until_complete(scenario())
+
+    assert bot.calls == [("send", 100, "Hello", ""), ("edit", 100, "Hello", None)]
+
+
+def test_think_filter_matches_the_regex_however_the_text_is_split():
+    text = "<think>plan <b>it</b></think>Answer with <i>tags</i> and a </th<think>more</think> end<thin"
+
+    for size in (1, 2, 3, 5, 8, len(text)):
+        think = ThinkFilter()
+        shown = "".join(think(text[i : i + size]) for i in range(0, len(text), size))
+        shown += think("", True)
+        assert shown == no_need_to_think(text, partial=True), size
+
+
+def test_transform_is_applied_to_deltas(loop):
+    bot = RecordingBot()
+    reply = StreamingReply(bot, message(), edit_interval=0, transform=ThinkFilter())
+
+    async def scenario():
+        for delta in ("<thi", "nk>hmm", "</think>", "Hi"):
+            await reply.feed(delta)
+        return await reply.finish()
+
+    assert loop.run_until_complete(scenario()) == "Hi"
+    assert bot.calls[0] == ("send", 100, "Hi", "")
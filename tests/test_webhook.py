@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+import pytest
+
+from webhook import SECRET_HEADER, create_app, run_webhook
+
+UPDATE = {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"},
+                                      "from": {"id": 1, "is_bot": False, "first_name": "Owner"}, "text": "/start"}}
+
+
+class RecordingBot:
+    def __init__(self):
+        self.updates = []
+
+    async def process_new_updates(self, updates):
+        self.updates += updates
+
+
+def post(loop, secret, headers):
+    from aiohttp.test_utils import TestClient, TestServer
+
+    bot = RecordingBot()
+
+    async def send():
+        async with TestClient(TestServer(create_app(bot, secret=secret))) as client:
+            response = await client.post("/webhook", data=json.dumps(UPDATE), headers=headers)
+            # updates are processed in a background task
+            await asyncio.sleep(0)
+            return response.status
+
+    return loop.run_until_complete(send()), bot.updates
+
+
+def test_accepts_the_secret(loop):
+    status, updates = post(loop, "s3cret", {SECRET_HEADER: "s3cret"})
+    assert status == 200
+    assert len(updates) == 1
+    assert (updates[0].update_id, updates[0].message.text) == (1, "/start")
+
+
+@pytest.mark.parametrize("headers", [{}, {SECRET_HEADER: "wrong"}])
+def test_rejects_a_bad_secret(loop, headers):
+    status, updates = post(loop, "s3cret", headers)
+    assert (status, updates) == (403, [])
+
+
+def test_rejects_everything_without_a_secret(loop):
+    status, updates = post(loop, None, {SECRET_HEADER: ""})
+    assert (status, updates) == (403, [])
+
+
+def test_refuses_to_serve_without_a_secret(loop):
+    with pytest.raises(ValueError):
+        loop.run_until_complete(run_webhook(RecordingBot(), "127.0.0.1", 0))
@@ -0,0 +1,108 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from gpt_assistant.crud.chats import register_chat
+from gpt_assistant.crud.users import register_user
+from gpt_assistant.db import Message, SessionLocal
+from gpt_assistant.db.writer import WriteBehindQueue
+
+
+def row(chat_id: int, message_id: int, content="hi") -> dict:
+    return dict(
+        content=content,
+        message_id=message_id,
+        author_id=chat_id,
+        chat_id=chat_id,
+        role="user",
+        model="fake-model",
+    )
+
+
+async def setup_chat(chat_id: int) -> None:
+    async with SessionLocal() as session:
+        await register_user(session, chat_id)
+        await register_chat(session, chat_id)
+
+
+async def stored(chat_id: int) -> int:
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(func.count()).select_from(Message).where(Message.chat_id == chat_id)
+        )
+        return result.scalar()
+
+
+def test_writes_in_batches_of_batch_size(harness, loop):
+    writer = WriteBehindQueue(Message, batch_size=3, flush_interval=0.05)
+
+    async def scenario():
+        await setup_chat(80_001)
+        for message_id in range(7):
+            await writer.put(**row(80_001, message_id))
+        await writer.flush()
+        count = await stored(80_001)
+        await writer.stop()
+        return count
+
+    assert loop.run_until_complete(scenario()) == 7
+    assert writer.stats() == {"queued": 0, "batches": 3, "rows_written": 7, "rows_failed": 0}
+
+
+def test_flushes_after_the_interval(harness, loop):
+    writer = WriteBehindQueue(Message, batch_size=100, flush_interval=0.05)
+
+    async def scenario():
+        await setup_chat(80_002)
+        await writer.put(**row(80_002, 1))
+        # nobody calls flush, the worker doesn't wait for a full batch
+        await asyncio.sleep(0.3)
+        count = await stored(80_002)
+        await writer.stop()
+        return count
+
+    assert loop.run_until_complete(scenario()) == 1
+    assert writer.batches == 1
+
+
+def test_falls_back_to_single_rows_when_a_batch_fails(harness, loop):
+    writer = WriteBehindQueue(Message, batch_size=10, flush_interval=0.05)
+
+    async def scenario():
+        await setup_chat(80_003)
+        await writer.put(**row(80_003, 1))
+        # content is NOT NULL, this row fails the whole INSERT
+        await writer.put(**row(80_003, 2, content=None))
+        await writer.put(**row(80_003, 3))
+        await writer.flush()
+        count = await stored(80_003)
+        await writer.stop()
+        return count
+
+    assert loop.run_until_complete(scenario()) == 2
+    assert writer.stats() == {"queued": 0, "batches": 0, "rows_written": 2, "rows_failed": 1}
+
+
+def test_flush_pending_waits_only_for_its_key(harness, loop):
+    writer = WriteBehindQueue(
+        Message,
+        batch_size=100,
+        flush_interval=0.2,
+        key=lambda values: values["chat_id"],
+    )
+
+    async def scenario():
+        await setup_chat(80_004)
+        await writer.put(**row(80_004, 1))
+
+        # nothing pending for another chat, returns without waiting out the interval
+        await asyncio.wait_for(writer.flush_pending(80_005), 0.1)
+        before = await stored(80_004)
+
+        await asyncio.wait_for(writer.flush_pending(80_004), 1)
+        after = await stored(80_004)
+
+        await writer.stop()
+        return before, after
+
+    assert loop.run_until_complete(scenario()) == (0, 1)